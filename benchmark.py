@@ -0,0 +1,311 @@
+import os
+import re
+import json
+import time
+import base64
+import argparse
+import datetime
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+import utils
+from utils import (
+    Config, BirthdayIndex, get_today_birthdays, generate_birthday_message,
+    generate_birthday_messages, iter_sheet_records, read_sheet_columns, read_sheet_data,
+    run_birthday_pipeline, send_birthday_email, send_birthday_emails_batch
+)
+
+HEADER = ['nombre', 'correo electrónico', 'fecha de nacimiento', 'parentesco', 'genero']
+MONTH_DAYS = [31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+MALFORMED_DATES = ['sin fecha', '31-12-1990', '13/45', '1990/02', '']
+
+def synthetic_row(i):
+    """Fila sintética determinista; 1 de cada 20 tiene una fecha mal formada."""
+    h = (i * 2654435761) % 2 ** 32
+    month = h % 12 + 1
+    day = (h // 12) % MONTH_DAYS[month - 1] + 1
+    year = 1940 + (h // 372) % 80
+    if i % 20 == 0:
+        fecha = MALFORMED_DATES[(i // 20) % len(MALFORMED_DATES)]
+    elif i % 2:
+        fecha = f"{month:02d}/{day:02d}"
+    else:
+        fecha = f"{year}/{month:02d}/{day:02d}"
+    return [f"Persona {i}", f"persona{i}@example.com", fecha, 'amigo/a', 'femenino' if h % 2 else 'masculino']
+
+class FakeSheetsService:
+    """Imita spreadsheets().get() y spreadsheets().values().get() sobre una hoja sintética.
+
+    Las filas se generan al pedirlas, así que la memoria medida es la del
+    código del bot y no la de la hoja falsa.
+    """
+    def __init__(self, rows, latency=0.0):
+        self.rows = rows
+        self.latency = latency
+        self.calls = 0
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def get(self, spreadsheetId, range=None, ranges=None, fields=None):
+        if range is None:
+            # spreadsheets().get(): metadatos con el tamaño de la cuadrícula
+            grid = {'rowCount': self.rows + 1, 'columnCount': len(HEADER)}
+            return _FakeRequest(self, lambda: {'sheets': [{'properties': {'gridProperties': grid}}]})
+        match = re.match(r'^(?:.+!)?[A-Z]+(\d*):[A-Z]+(\d*)$', range)
+        first = int(match[1]) if match[1] else 1
+        last = int(match[2]) if match[2] else self.rows + 1
+        return _FakeRequest(self, lambda: self._values(first, last))
+
+    def batchGet(self, spreadsheetId, ranges, majorDimension='ROWS',
+                 valueRenderOption='FORMATTED_VALUE', dateTimeRenderOption=None):
+        assert majorDimension == 'COLUMNS'
+        columns = [utils._column_number(re.match(r'^(?:.+!)?([A-Z]+)', r)[1]) - 1 for r in ranges]
+        serials = valueRenderOption == 'UNFORMATTED_VALUE'
+        return _FakeRequest(self, lambda: self._columns(ranges, columns, serials))
+
+    def _columns(self, ranges, columns, serials):
+        """Columnas completas; con serials las fechas YYYY/MM/DD llegan como en
+        una celda con tipo fecha (número de serie)."""
+        rows = [synthetic_row(i) for i in range(self.rows)]
+        return {'valueRanges': [
+            {'range': r, 'values': [[HEADER[c]] + [self._cell(row[c], c, serials) for row in rows]]}
+            for r, c in zip(ranges, columns)
+        ]}
+
+    @staticmethod
+    def _cell(value, column, serials):
+        if serials and column == 2 and value.count('/') == 2:
+            try:
+                year, month, day = map(int, value.split('/'))
+                value = (datetime.date(year, month, day) - utils.SERIAL_EPOCH).days
+            except ValueError:
+                pass
+        return value
+
+    def _values(self, first, last):
+        values = []
+        for number in range(first, min(last, self.rows + 1) + 1):
+            values.append(HEADER if number == 1 else synthetic_row(number - 2))
+        return {'values': values} if values else {}
+
+class FakeGmailService:
+    """Imita users().messages().send() y new_batch_http_request()."""
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+        self.sent = 0
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def send(self, userId, body):
+        base64.urlsafe_b64decode(body['raw'])
+        return _FakeRequest(self, self._sent)
+
+    def _sent(self):
+        self.sent += 1
+        return {'id': str(self.sent)}
+
+    def new_batch_http_request(self, callback):
+        return _FakeBatch(self, callback)
+
+class _FakeRequest:
+    def __init__(self, service, result):
+        self.service = service
+        self.result = result
+
+    def execute(self, http=None):
+        self.service.calls += 1
+        time.sleep(self.service.latency)
+        return self.result()
+
+class _FakeBatch:
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request, request_id))
+
+    def execute(self):
+        self.service.calls += 1
+        time.sleep(self.service.latency)
+        for request, request_id in self.requests:
+            self.callback(request_id, request.result(), None)
+
+class FakeGeminiModel:
+    """Imita GenerativeModel.generate_content, incluidas las respuestas JSON agrupadas."""
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+
+    def generate_content(self, prompt, generation_config=None):
+        self.calls += 1
+        time.sleep(self.latency)
+        if generation_config and generation_config.get('response_mime_type') == 'application/json':
+            ids = re.findall(r'^- id (\d+):', prompt, re.MULTILINE)
+            text = json.dumps([{'id': int(i), 'mensaje': f"¡Feliz cumpleaños! ({i})"} for i in ids])
+        else:
+            text = "¡Feliz cumpleaños!"
+        return _FakeResponse(text)
+
+class _FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+def measure(name, items, function):
+    """Ejecuta function midiendo tiempo y, si tracemalloc está activo, el pico de memoria."""
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] if tracing else None
+    count = items(result) if callable(items) else items
+    return result, {
+        'etapa': name,
+        'segundos': round(seconds, 4),
+        'elementos': count,
+        'por_segundo': round(count / seconds, 1) if seconds else None,
+        'pico_mb': round(peak / 2 ** 20, 2) if peak is not None else None,
+    }
+
+def run_benchmark(rows, args, date):
+    """Mide lectura, búsqueda, generación y envío sobre una hoja de rows filas."""
+    config = Config()
+    config.spreadsheet_id = 'benchmark'
+    config.range_name = 'Hoja1!A:E'
+    config.sheet_reader = args.reader
+    config.sheet_page_size = args.page_size
+    config.generate_workers = args.generate_workers
+    config.send_workers = args.send_workers
+    config.send_mode = args.send_mode
+    config.gemini_batch_size = args.gemini_batch_size
+
+    sheets = FakeSheetsService(rows, args.sheets_latency)
+    gemini = FakeGeminiModel(args.gemini_latency)
+    utils._gemini_models[utils.GEMINI_MODEL] = gemini
+    stages = []
+
+    if args.memory:
+        tracemalloc.start()
+    try:
+        if args.reader == 'columns':
+            # Lee y decodifica las fechas en el mismo paso, devolviendo el índice
+            utils._column_cache.clear()
+            data, stage = measure('lectura+indexado', len, lambda: read_sheet_columns(sheets, config))
+            stages.append(stage)
+            index = data
+        else:
+            if args.reader == 'stream':
+                data, stage = measure('lectura', len, lambda: list(iter_sheet_records(sheets, config)))
+            else:
+                data, stage = measure('lectura', len, lambda: read_sheet_data(sheets, config))
+            stages.append(stage)
+            index, stage = measure('indexado', rows, lambda: BirthdayIndex(data))
+            stages.append(stage)
+        people, stage = measure('búsqueda', len, lambda: index.lookup(date))
+        stages.append(stage)
+        if args.reader == 'pandas':
+            _, stage = measure('get_today_birthdays', rows, lambda: get_today_birthdays(data))
+            stages.append(stage)
+        del data
+
+        people = people[:args.max_people] if args.max_people else people
+        if people:
+            def generate():
+                size = max(1, config.gemini_batch_size)
+                groups = [people[i:i + size] for i in range(0, len(people), size)]
+                with ThreadPoolExecutor(config.generate_workers) as pool:
+                    if size == 1:
+                        return list(pool.map(lambda g: [generate_birthday_message(g[0])], groups))
+                    return list(pool.map(generate_birthday_messages, groups))
+            _, stage = measure('generación', len(people), generate)
+            stages.append(stage)
+
+            def send():
+                gmail = FakeGmailService(args.gmail_latency)
+                emails = [(p['correo electrónico'], 'Asunto', 'Mensaje') for p in people]
+                if config.send_mode == 'batch':
+                    return send_birthday_emails_batch(gmail, emails, 'bot@example.com', config.email_batch_size)
+                with ThreadPoolExecutor(config.send_workers) as pool:
+                    return list(pool.map(
+                        lambda email: send_birthday_email(gmail, *email, 'bot@example.com'), emails
+                    ))
+            _, stage = measure('envío', len(people), send)
+            stages.append(stage)
+
+            gmail = FakeGmailService(args.gmail_latency)
+            _, stage = measure('pipeline', len(people), lambda: run_birthday_pipeline(
+                people, gmail, config, 'bot@example.com', date
+            ))
+            stages.append(stage)
+    finally:
+        if args.memory:
+            tracemalloc.stop()
+
+    return {
+        'filas': rows,
+        'cumpleaños': len(people),
+        'llamadas_sheets': sheets.calls,
+        'llamadas_gemini': gemini.calls,
+        'etapas': stages,
+    }
+
+def print_report(report):
+    print(f"\n{report['filas']} filas, {report['cumpleaños']} cumpleaños, "
+          f"{report['llamadas_sheets']} llamadas a Sheets, {report['llamadas_gemini']} a Gemini")
+    print(f"{'etapa':<22}{'segundos':>10}{'elementos':>12}{'por segundo':>14}{'pico MB':>10}")
+    for stage in report['etapas']:
+        print(f"{stage['etapa']:<22}{stage['segundos']:>10}{stage['elementos']:>12}"
+              f"{stage['por_segundo'] or '-':>14}{stage['pico_mb'] or '-':>10}")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark sin conexión del bot con hojas sintéticas y servicios falsos."
+    )
+    parser.add_argument('--rows', default='1000,10000,100000,1000000',
+                        help="tamaños de hoja separados por comas")
+    parser.add_argument('--reader', choices=['pandas', 'stream', 'columns'],
+                        default='pandas' if utils.HAS_PANDAS else 'stream')
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--date', type=datetime.date.fromisoformat, default=datetime.date.today(),
+                        help="fecha a consultar (YYYY-MM-DD), hoy por defecto")
+    parser.add_argument('--sheets-latency', type=float, default=0.05, help="segundos por llamada")
+    parser.add_argument('--gemini-latency', type=float, default=0.02, help="segundos por llamada")
+    parser.add_argument('--gmail-latency', type=float, default=0.01, help="segundos por llamada")
+    parser.add_argument('--generate-workers', type=int, default=4)
+    parser.add_argument('--send-workers', type=int, default=2)
+    parser.add_argument('--send-mode', choices=['individual', 'batch'], default='individual')
+    parser.add_argument('--gemini-batch-size', type=int, default=1)
+    parser.add_argument('--max-people', type=int, default=500,
+                        help="máximo de cumpleañeros a generar y enviar (0 = todos)")
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help="no mide memoria; tracemalloc hace más lentas las etapas")
+    parser.add_argument('--json', dest='json_path', help="guarda los resultados en este archivo")
+    args = parser.parse_args()
+
+    # Los servicios falsos no tienen cuota: sin límite de tasa salvo que se pida
+    for api in ('GEMINI', 'GMAIL', 'SHEETS'):
+        os.environ.setdefault(f'RATE_LIMIT_{api}', '0')
+
+    reports = []
+    for rows in [int(value) for value in args.rows.split(',')]:
+        report = run_benchmark(rows, args, args.date)
+        print_report(report)
+        reports.append(report)
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(reports, f, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+import os
+import re
+import ast
+import sys
+import json
+import shutil
+import sysconfig
+import argparse
+import subprocess
+import compileall
+import py_compile
+import importlib.util
+from pathlib import Path
+
+ENTRY_MODULE = 'gcf'
+
+# Paquete de requirements.txt que provee cada módulo importado (el prefijo más
+# largo gana). Los módulos que no aparecen aquí llegan como dependencias de otros.
+DISTRIBUTIONS = {
+    'googleapiclient': 'google-api-python-client',
+    'google_auth_httplib2': 'google-auth-httplib2',
+    'google_auth_oauthlib': 'google-auth-oauthlib',
+    'google.cloud.secretmanager': 'google-cloud-secret-manager',
+    'google.cloud.pubsub_v1': 'google-cloud-pubsub',
+    'google.cloud.storage': 'google-cloud-storage',
+    'google.cloud.functions': 'google-cloud-functions',
+    'google.generativeai': 'google-generativeai',
+    'functions_framework': 'functions-framework',
+    'pandas': 'pandas',
+    'numpy': 'pandas',
+    'dotenv': 'python-dotenv',
+}
+
+# Transitivas de los paquetes anteriores: se importan pero no necesitan línea propia
+TRANSITIVE = {'httplib2', 'google.auth', 'google.oauth2'}
+
+# Dependencias que solo se usan con cierta configuración de la función
+OPTIONAL_DISTRIBUTIONS = {
+    # Sin pandas, utils lee la hoja por páginas (SHEET_READER=stream)
+    'pandas': lambda env: env.get('SHEET_READER', 'pandas') == 'pandas',
+    # Solo GCSSnapshotStore usa Cloud Storage
+    'google-cloud-storage': lambda env: bool(env.get('SNAPSHOT_BUCKET')),
+}
+
+def is_stdlib(name):
+    top = name.split('.')[0]
+    if top in getattr(sys, 'stdlib_module_names', ()) or top in sys.builtin_module_names:
+        return True
+    spec = importlib.util.find_spec(top)
+    origin = getattr(spec, 'origin', None) or ''
+    return origin == 'built-in' or (
+        origin.startswith(sysconfig.get_paths()['stdlib']) and 'site-packages' not in origin
+    )
+
+def module_imports(path):
+    """Módulos importados por un archivo, incluidos los timed_import('...') perezosos."""
+    tree = ast.parse(Path(path).read_text(encoding='utf-8'), filename=str(path))
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.add(node.module)
+        elif (isinstance(node, ast.Call) and getattr(node.func, 'id', None) == 'timed_import'
+              and node.args and isinstance(node.args[0], ast.Constant)):
+            names.add(node.args[0].value)
+    return names
+
+def trace_imports(source_dir='.', entry=ENTRY_MODULE):
+    """Recorre los imports alcanzables desde entry.
+
+    Devuelve (módulos locales, módulos de terceros). Los módulos locales son
+    los .py de source_dir; la biblioteca estándar se descarta.
+    """
+    source_dir = Path(source_dir)
+    local, external = [], set()
+    pending = [entry]
+    while pending:
+        name = pending.pop()
+        if name in local:
+            continue
+        local.append(name)
+        for imported in module_imports(source_dir / f"{name}.py"):
+            top = imported.split('.')[0]
+            if (source_dir / f"{top}.py").exists():
+                pending.append(top)
+            elif not is_stdlib(imported):
+                external.add(imported)
+    return local, external
+
+def distribution_for(module):
+    for prefix in sorted(DISTRIBUTIONS, key=len, reverse=True):
+        if module == prefix or module.startswith(prefix + '.'):
+            return DISTRIBUTIONS[prefix]
+    return None
+
+def prune_requirements(modules, requirements_path='requirements.txt', env=None):
+    """Líneas de requirements.txt que proveen algún módulo de modules.
+
+    Devuelve (requirements, módulos sin paquete conocido).
+    """
+    env = os.environ if env is None else env
+    needed, unknown = set(), []
+    for module in sorted(modules):
+        distribution = distribution_for(module)
+        if distribution is not None:
+            needed.add(distribution)
+        elif not any(module == t or module.startswith(t + '.') for t in TRANSITIVE):
+            unknown.append(module)
+    needed = {
+        name for name in needed
+        if name not in OPTIONAL_DISTRIBUTIONS or OPTIONAL_DISTRIBUTIONS[name](env)
+    }
+
+    requirements = []
+    for line in Path(requirements_path).read_text(encoding='utf-8').splitlines():
+        name = re.split(r'[<>=!~\[;\s]', line.strip(), maxsplit=1)[0]
+        if name and not line.lstrip().startswith('#') and name.lower() in needed:
+            requirements.append(line.strip())
+    return requirements, unknown
+
+def compile_bundle(bundle_path, runtime):
+    """Precompila el bytecode si la versión local coincide con la del runtime.
+
+    Se usan .pyc basados en hash, que no dependen de las fechas de los
+    archivos y siguen siendo válidos tras subirlos. Con otra versión de
+    Python los .pyc serían ignorados, así que no se generan.
+    """
+    local_runtime = f"python{sys.version_info.major}{sys.version_info.minor}"
+    if local_runtime != runtime:
+        print(f"Bytecode no precompilado: Python local {local_runtime}, runtime {runtime}")
+        return False
+    compileall.compile_dir(
+        str(bundle_path), quiet=1,
+        invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH
+    )
+    return True
+
+_IMPORT_PROBE = '''
+import sys, time, importlib
+start = time.perf_counter()
+importlib.import_module(sys.argv[1])
+print(time.perf_counter() - start)
+'''
+
+def measure_import_time(bundle_path, modules):
+    """Tiempo de importación en frío de main y de cada dependencia.
+
+    Cada módulo se importa en un proceso nuevo, así el tiempo no depende de
+    lo que otro import ya haya cargado. None si el módulo no está instalado.
+    Con -B no se escriben .pyc en el paquete, que cambiarían su hash.
+    """
+    times = {}
+    for name in ['main', *sorted(modules)]:
+        result = subprocess.run(
+            [sys.executable, '-B', '-c', _IMPORT_PROBE, name],
+            cwd=bundle_path, capture_output=True, text=True
+        )
+        times[name] = round(float(result.stdout), 4) if result.returncode == 0 else None
+    return times
+
+def bundle_size(bundle_path):
+    return sum(path.stat().st_size for path in Path(bundle_path).rglob('*') if path.is_file())
+
+def build_bundle(bundle_path, runtime, source_dir='.', env=None, report=True):
+    """Arma en bundle_path el paquete mínimo de la Cloud Function.
+
+    Copia gcf.py como main.py y los módulos locales que alcanza, escribe un
+    requirements.txt con solo los paquetes importados y precompila el
+    bytecode. Devuelve un resumen con el tamaño y los tiempos de importación.
+    """
+    source_dir, bundle_path = Path(source_dir), Path(bundle_path)
+    local, external = trace_imports(source_dir)
+    requirements, unknown = prune_requirements(external, source_dir / 'requirements.txt', env)
+    if unknown:
+        print(f"Aviso: imports sin paquete conocido en requirements.txt: {', '.join(unknown)}")
+
+    for name in local:
+        target = 'main.py' if name == ENTRY_MODULE else f"{name}.py"  # GCF necesita main.py
+        shutil.copy2(source_dir / f"{name}.py", bundle_path / target)
+    (bundle_path / 'requirements.txt').write_text('\n'.join(requirements) + '\n', encoding='utf-8')
+    compiled = compile_bundle(bundle_path, runtime)
+
+    summary = {
+        'modulos': ['main' if name == ENTRY_MODULE else name for name in local],
+        'requirements': requirements,
+        'bytecode': compiled,
+        'tamano_kb': round(bundle_size(bundle_path) / 1024, 1),
+    }
+    if report:
+        summary['importacion_s'] = measure_import_time(bundle_path, external)
+        print_report(summary)
+    return summary
+
+def print_report(summary):
+    print(f"Paquete: {len(summary['modulos'])} módulos, {summary['tamano_kb']} KB, "
+          f"bytecode {'precompilado' if summary['bytecode'] else 'sin precompilar'}")
+    print(f"requirements.txt: {', '.join(summary['requirements'])}")
+    for name, seconds in summary.get('importacion_s', {}).items():
+        print(f"  import {name:<32}{'no instalado' if seconds is None else f'{seconds:.3f} s'}")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Arma el paquete mínimo de la Cloud Function y reporta su tamaño."
+    )
+    parser.add_argument('--output', default='deploy_tmp', help="carpeta del paquete")
+    parser.add_argument('--runtime', default='python39')
+    parser.add_argument('--json', dest='json_path', help="guarda el resumen en este archivo")
+    args = parser.parse_args()
+
+    output = Path(args.output)
+    if output.exists():
+        shutil.rmtree(output)
+    output.mkdir()
+    summary = build_bundle(output, args.runtime)
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+import json
+import time
+import datetime
+
+CHECKPOINT_VERSION = 1
+
+def checkpoint_key(spreadsheet_id):
+    """Clave única del punto de control de una ejecución sobre la hoja."""
+    return f"checkpoint-{spreadsheet_id}-{time.strftime('%Y%m%dT%H%M%S')}"
+
+def dump_checkpoint(results, previous=None):
+    """Estado para continuar: personas pendientes con su fecha y las ya procesadas.
+
+    Las procesadas se acumulan con las de previous, el punto de control del
+    que partió esta ejecución, si lo hay.
+    """
+    completed = {key: list(names) for key, names in ((previous or {}).get('completados') or {}).items()}
+    for key in ('enviados', 'fallidos', 'omitidos'):
+        completed.setdefault(key, []).extend(results.get(key, []))
+    return {
+        'version': CHECKPOINT_VERSION,
+        'creado': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'pendientes': [[date.isoformat(), person] for date, person in results['pendientes']],
+        'completados': completed,
+    }
+
+def pending_from(state):
+    """Lista de (fecha, persona) pendientes de un punto de control."""
+    return [
+        (datetime.date.fromisoformat(date), person)
+        for date, person in state.get('pendientes', [])
+    ]
+
+def save_checkpoint(store, key, state):
+    store.write(key, json.dumps(state, ensure_ascii=False, default=str).encode('utf-8'))
+
+def load_checkpoint(store, key):
+    """Lee un punto de control del almacén; None si no existe o es de otra versión."""
+    data = store.read(key)
+    if data is None:
+        return None
+    state = json.loads(data.decode('utf-8'))
+    return state if state.get('version') == CHECKPOINT_VERSION else None
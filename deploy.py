@@ -1,9 +1,35 @@
 import os
+import sys
 import json
+import base64
+import shlex
 import shutil
+import hashlib
 from pathlib import Path
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from bundle import build_bundle
+
+REGION = 'us-central1'
+RUNTIME = 'python39'
+FUNCTION_NAME = 'birthday-reminder'
+TOPIC = 'birthday-reminder'
+
+# Etiqueta con el hash del contenido desplegado, en secretos y en la función
+HASH_LABEL = 'content-hash'
+
+# Variables de configuración opcionales que se pasan a la función si existen
+OPTIONAL_ENV_VARS = [
+    'GENERATE_WORKERS', 'SEND_WORKERS', 'SEND_MODE', 'EMAIL_BATCH_SIZE',
+    'SHEET_READER', 'SHEET_PAGE_SIZE', 'FAST_STARTUP', 'SECRET_TTL_SECONDS',
+    'SNAPSHOT_BUCKET', 'SNAPSHOT_DIR', 'LOOKAHEAD_DAYS', 'GEMINI_BATCH_SIZE',
+    'PROFILE', 'SPREADSHEETS', 'FANOUT_MODE', 'FANOUT_WORKERS', 'FANOUT_SHARDS',
+    'TIMEZONE', 'RATE_LIMIT_GEMINI', 'RATE_BURST_GEMINI', 'RETRY_ATTEMPTS_GEMINI',
+    'RATE_LIMIT_GMAIL', 'RATE_BURST_GMAIL', 'RETRY_ATTEMPTS_GMAIL',
+    'RATE_LIMIT_SHEETS', 'RATE_BURST_SHEETS', 'RETRY_ATTEMPTS_SHEETS', 'SEND_HOUR',
+    'RUN_BUDGET_SECONDS', 'MAX_CONTINUATIONS', 'DEADLINE_MARGIN_SECONDS',
+]
 
 def read_service_account():
     """Lee el archivo de credenciales de service account."""
@@ -18,15 +44,42 @@ def setup_deploy_folder():
         shutil.rmtree(deploy_path)
     deploy_path.mkdir()
 
-    # Copiar y renombrar archivos necesarios
-    shutil.copy2('gcf.py', deploy_path / 'main.py')  # GCF necesita main.py
-    shutil.copy2('utils.py', deploy_path / 'utils.py')
-    shutil.copy2('requirements.txt', deploy_path / 'requirements.txt')
+    # Copiar solo los módulos alcanzables desde gcf.py (renombrado a main.py),
+    # con un requirements.txt reducido y el bytecode precompilado
+    load_dotenv()
+    build_bundle(deploy_path, RUNTIME)
     
     return deploy_path
 
-def setup_secret_manager(creds):
-    """Configura los secretos en Secret Manager."""
+def gcloud_json(command):
+    """Ejecuta un comando gcloud de consulta y devuelve su salida JSON."""
+    result = subprocess.run(
+        f'{command} --format=json', shell=True, check=True, capture_output=True, text=True
+    )
+    return json.loads(result.stdout or 'null')
+
+def content_hash(*parts):
+    """Hash corto del contenido, válido como valor de etiqueta de GCP."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()[:32]
+
+def list_secrets():
+    """Devuelve {secret_id: hash desplegado} con una sola llamada a gcloud."""
+    return {
+        secret['name'].rsplit('/', 1)[-1]: (secret.get('labels') or {}).get(HASH_LABEL)
+        for secret in gcloud_json('gcloud secrets list') or []
+    }
+
+def setup_secret_manager(creds, force=False):
+    """Configura los secretos en Secret Manager.
+
+    Solo agrega una versión nueva cuando el hash del valor local difiere del
+    guardado en la etiqueta del secreto. El valor se pasa a gcloud por stdin,
+    sin escribirlo en disco.
+    """
     # Leer variables necesarias del .env
     load_dotenv()
     gemini_api_key = os.getenv('GEMINI_API_KEY')
@@ -40,34 +93,35 @@ def setup_secret_manager(creds):
         'gemini-api-key': gemini_api_key
     }
     
-    for secret_id, value in secrets.items():
-        # Verificar si el secreto ya existe
-        list_command = f'gcloud secrets list --filter="name:{secret_id}" --format="get(name)"'
-        result = subprocess.run(list_command, shell=True, capture_output=True, text=True)
-        
-        if secret_id not in result.stdout:
-            # Crear el secreto
-            create_command = f'gcloud secrets create {secret_id} --replication-policy="automatic"'
-            subprocess.run(create_command, shell=True, check=True)
-            print(f"Secreto {secret_id} creado")
-        
-        # Actualizar el valor del secreto
+    existing = list_secrets()
+
+    def update(secret_id, value):
         if isinstance(value, str) and os.path.exists(value):
-            update_command = f'gcloud secrets versions add {secret_id} --data-file="{value}"'
+            with open(value, 'rb') as f:
+                data = f.read()
         else:
             # Para valores directos como GEMINI_API_KEY
-            with open('temp_secret.txt', 'w') as f:
-                f.write(str(value))
-            update_command = f'gcloud secrets versions add {secret_id} --data-file="temp_secret.txt"'
-            
-        subprocess.run(update_command, shell=True, check=True)
-        
-        # Limpiar archivo temporal si fue creado
-        if os.path.exists('temp_secret.txt'):
-            os.remove('temp_secret.txt')
-            
+            data = str(value).encode('utf-8')
+        digest = content_hash(data)
+
+        if secret_id not in existing:
+            create_command = f'gcloud secrets create {secret_id} --replication-policy="automatic"'
+            subprocess.run(create_command, shell=True, check=True)
+            print(f"Secreto {secret_id} creado")
+        elif not force and existing[secret_id] == digest:
+            print(f"Secreto {secret_id} sin cambios")
+            return
+
+        update_command = f'gcloud secrets versions add {secret_id} --data-file=-'
+        subprocess.run(update_command, shell=True, check=True, input=data, capture_output=True)
+        label_command = f'gcloud secrets update {secret_id} --update-labels={HASH_LABEL}={digest}'
+        subprocess.run(label_command, shell=True, check=True, capture_output=True)
         print(f"Secreto {secret_id} actualizado")
 
+    with ThreadPoolExecutor(len(secrets)) as pool:
+        for future in [pool.submit(update, *item) for item in secrets.items()]:
+            future.result()
+
 def build_env_vars():
     """Construye la cadena de variables de entorno para el comando de deploy."""
     load_dotenv()
@@ -86,35 +140,39 @@ def build_env_vars():
     missing_vars = [key for key, value in env_vars.items() if not value]
     if missing_vars:
         raise ValueError(f"Faltan variables de entorno: {', '.join(missing_vars)}")
+
+    # Variables opcionales: solo se envían si están definidas en .env
+    for key in OPTIONAL_ENV_VARS:
+        if os.getenv(key):
+            env_vars[key] = os.getenv(key)
     
-    # Construir string de variables de entorno
-    env_vars_str = ' '.join([
-        f'--set-env-vars {key}="{value}"'
-        for key, value in env_vars.items()
-    ])
-    
-    return env_vars_str
+    return env_vars_flag(env_vars)
+
+def env_vars_flag(env_vars):
+    """Flag --set-env-vars con todas las variables, citado para el shell.
+
+    gcloud separa los pares con comas, y SPREADSHEETS trae una lista JSON con
+    comas y comillas. Se usa la sintaxis de delimitador alterno de gcloud
+    (^;^CLAVE=valor;CLAVE=valor) con un delimitador que no aparezca en
+    ningún valor.
+    """
+    pairs = [f'{key}={value}' for key, value in env_vars.items()]
+    delimiter = next(d for d in ';|@~#' if not any(d in pair for pair in pairs))
+    return '--set-env-vars ' + shlex.quote(f'^{delimiter}^' + delimiter.join(pairs))
 
 def create_topic():
     """Crea el topic de Pub/Sub si no existe."""
-    # Primero verificamos si el topic existe
-    # Usamos --format=json para parsing más confiable
-    check_command = 'gcloud pubsub topics list --format=json'
-    
     try:
-        result = subprocess.run(check_command, shell=True, capture_output=True, text=True)
-        topics = json.loads(result.stdout)
-        for topic in topics:
-            if '/topics/birthday-reminder' in topic['name']:
-                print("El topic ya existe, continuando...")
-                return True
-        print("El topic no existe, creándolo...")
+        topics = gcloud_json('gcloud pubsub topics list') or []
     except (subprocess.CalledProcessError, json.JSONDecodeError) as e:
         print(f"Error al verificar topics existentes: {e}")
         return False
+    if any(topic['name'].endswith(f'/topics/{TOPIC}') for topic in topics):
+        print("El topic ya existe, continuando...")
+        return True
 
-    # Si no existe, intentamos crearlo
-    create_command = 'gcloud pubsub topics create birthday-reminder'
+    print("El topic no existe, creándolo...")
+    create_command = f'gcloud pubsub topics create {TOPIC}'
     try:
         subprocess.run(create_command, shell=True, check=True)
         print("Topic de Pub/Sub creado exitosamente")
@@ -124,21 +182,47 @@ def create_topic():
         print(f"Error al crear el topic: {e}")
         return False
 
-def deploy_function(deploy_path, env_vars, creds):
-    """Despliega la función en Google Cloud Functions."""
+def deployed_source_hash():
+    """Hash del código desplegado, o None si la función no existe."""
+    describe_command = f'gcloud functions describe {FUNCTION_NAME} --gen2 --region {REGION}'
+    try:
+        function = gcloud_json(describe_command) or {}
+    except (subprocess.CalledProcessError, json.JSONDecodeError):
+        return None
+    return (function.get('labels') or {}).get(HASH_LABEL)
+
+def source_hash(deploy_path, deploy_command):
+    """Hash de los archivos de la carpeta de deploy y del comando con sus flags."""
+    parts = [deploy_command]
+    for path in sorted(Path(deploy_path).rglob('*')):
+        if path.is_file():
+            parts += [path.relative_to(deploy_path).as_posix(), path.read_bytes()]
+    return content_hash(*parts)
+
+def deploy_function(deploy_path, env_vars, creds, deployed_hash=None):
+    """Despliega la función en Google Cloud Functions.
+
+    Se omite si el código y la configuración coinciden con los desplegados
+    (deployed_hash, la etiqueta de la función).
+    """
     deploy_command = (
-        f'gcloud functions deploy birthday-reminder '  # nombre de la función en GCP
+        f'gcloud functions deploy {FUNCTION_NAME} '  # nombre de la función en GCP
         f'--gen2 '  # Especificar Gen 2
-        f'--runtime python39 '
-        f'--region us-central1 '  # Especificar región
+        f'--runtime {RUNTIME} '
+        f'--region {REGION} '  # Especificar región
         f'--memory 512MB '  # Aumentar memoria disponible
         f'--timeout 60s '  # Establecer timeout en 60 segundos
-        f'--trigger-topic birthday-reminder '
+        f'--trigger-topic {TOPIC} '
         f'--entry-point birthday_reminder '  # nombre de la función en el código
         f'--service-account {creds["client_email"]} '  # Usar el mismo service account
         f'--source {deploy_path} '
         f'{env_vars}'
     )
+    digest = source_hash(deploy_path, deploy_command)
+    if digest == deployed_hash:
+        print("El código de la función no cambió, se omite el deploy")
+        return True
+    deploy_command += f' --update-labels {HASH_LABEL}={digest}'
     
     print(f"Ejecutando comando de deploy:\n{deploy_command}")
     
@@ -151,33 +235,59 @@ def deploy_function(deploy_path, env_vars, creds):
     
     return True
 
-def create_scheduler():
-    """Crea o actualiza el Cloud Scheduler job."""
-    scheduler_command = (
-        'gcloud scheduler jobs create pubsub birthday-reminder-job '
-        '--schedule "0 8 * * *" '
-        '--topic birthday-reminder '
-        '--message-body "Check birthdays" '
-        '--time-zone "America/Bogota" '
-        '--location us-central1'
+def list_scheduler_jobs():
+    """Devuelve {nombre: job} de los Cloud Scheduler jobs de la región."""
+    try:
+        jobs = gcloud_json(f'gcloud scheduler jobs list --location {REGION}') or []
+    except (subprocess.CalledProcessError, json.JSONDecodeError):
+        return {}
+    return {job['name'].rsplit('/', 1)[-1]: job for job in jobs}
+
+def create_scheduler(job_name='birthday-reminder-job', schedule='0 8 * * *',
+                     message_body='Check birthdays', time_zone='America/Bogota', existing=None):
+    """Crea o actualiza el Cloud Scheduler job.
+
+    Si existing (ver list_scheduler_jobs) muestra el job con la misma
+    programación y mensaje, no se hace nada.
+    """
+    job = (existing or {}).get(job_name)
+    if job is not None:
+        target = job.get('pubsubTarget') or {}
+        data = base64.b64decode(target.get('data', '')).decode('utf-8')
+        if (job.get('schedule'), job.get('timeZone'), data) == (schedule, time_zone, message_body) \
+                and target.get('topicName', '').endswith(f'/topics/{TOPIC}'):
+            print(f"Scheduler {job_name} sin cambios")
+            return True
+
+    job_options = (
+        f'--schedule "{schedule}" '
+        f'--topic {TOPIC} '
+        f"--message-body '{message_body}' "
+        f'--time-zone "{time_zone}" '
+        f'--location {REGION}'
     )
+    if job is not None:
+        # Si ya existe, lo actualizamos directamente
+        scheduler_command = f'gcloud scheduler jobs update pubsub {job_name} {job_options}'
+        try:
+            subprocess.run(scheduler_command, shell=True, check=True)
+            print(f"Scheduler {job_name} actualizado exitosamente")
+        except subprocess.CalledProcessError as e:
+            print(f"Error al configurar el scheduler: {e}")
+            return False
+        return True
+
+    scheduler_command = f'gcloud scheduler jobs create pubsub {job_name} {job_options}'
     
     try:
         subprocess.run(scheduler_command, shell=True, check=True)
-        print("Scheduler configurado exitosamente")
+        print(f"Scheduler {job_name} configurado exitosamente")
     except subprocess.CalledProcessError:
         # Si ya existe, intentamos actualizarlo
-        update_command = (
-            'gcloud scheduler jobs update pubsub birthday-reminder-job '
-            '--schedule "0 8 * * *" '
-            '--topic birthday-reminder '
-            '--message-body "Check birthdays" '
-            '--time-zone "America/Bogota" '
-            '--location us-central1'
-        )
+        update_command = f'gcloud scheduler jobs update pubsub {job_name} {job_options}'
         try:
             subprocess.run(update_command, shell=True, check=True)
-            print("Scheduler actualizado exitosamente")
+            print(f"Scheduler {job_name} actualizado exitosamente")
         except subprocess.CalledProcessError as e:
             print(f"Error al configurar el scheduler: {e}")
             return False
@@ -189,8 +299,32 @@ def cleanup(deploy_path):
     shutil.rmtree(deploy_path)
     print(f"Carpeta temporal {deploy_path} eliminada")
 
-def main():
+def grant_owner_role(creds):
+    """Da permisos Owner a la cuenta de servicio si aún no los tiene."""
+    service_account = f"serviceAccount:{creds['client_email']}"
+    policy = gcloud_json(f'gcloud projects get-iam-policy {creds["project_id"]}') or {}
+    for binding in policy.get('bindings', []):
+        if binding.get('role') == 'roles/owner' and service_account in binding.get('members', []):
+            print(f"{service_account} ya tiene permisos de Owner")
+            return
+    project_bind_command = (
+        f'gcloud projects add-iam-policy-binding {creds["project_id"]} '
+        f'--member="{service_account}" '
+        '--role="roles/owner"'
+    )
+    subprocess.run(project_bind_command, shell=True, check=True, capture_output=True)
+    print(f"Permisos de Owner asignados a {service_account}")
+
+def main(force=False):
+    """Despliega solo lo que cambió; con force se redespliega todo."""
     print("Iniciando proceso de deploy...")
+
+    load_dotenv()
+    if os.getenv('HOURLY_MODE') and not os.getenv('SNAPSHOT_BUCKET'):
+        # Sin instantánea compartida, cada una de las 24 ejecuciones diarias
+        # leería la hoja completa: SNAPSHOT_DIR es el disco de una sola instancia
+        print("Error: HOURLY_MODE requiere SNAPSHOT_BUCKET")
+        return
     
     # Leer credenciales
     try:
@@ -207,29 +341,43 @@ def main():
     deploy_path = setup_deploy_folder()
     print(f"Carpeta de deploy creada en: {deploy_path}")
     
-    # Dar permisos Owner a la cuenta de servicio
-    service_account = f"serviceAccount:{creds['client_email']}"
-    project_bind_command = (
-        f'gcloud projects add-iam-policy-binding {creds["project_id"]} '
-        f'--member="{service_account}" '
-        '--role="roles/owner"'
-    )
-    subprocess.run(project_bind_command, shell=True, check=True)
-    print(f"Permisos de Owner asignados a {service_account}")
-
-    # Configurar Secret Manager y construir variables de entorno
-    setup_secret_manager(creds)
+    # Pasos independientes en paralelo: permisos, secretos, topic y consultas
+    # del estado desplegado de la función y los schedulers
+    with ThreadPoolExecutor(5) as pool:
+        binding = pool.submit(grant_owner_role, creds)
+        secrets = pool.submit(setup_secret_manager, creds, force)
+        topic = pool.submit(create_topic)
+        deployed_hash = pool.submit(deployed_source_hash)
+        jobs = pool.submit(list_scheduler_jobs)
+        binding.result()
+        secrets.result()
     env_vars = build_env_vars()
     print("Secretos y variables de entorno configurados")
-    
-    # Crear topic y desplegar función
-    if create_topic() and deploy_function(deploy_path, env_vars, creds):
-        # Configurar scheduler
-        create_scheduler()
+
+    if topic.result():
+        # La función y los schedulers solo dependen del topic
+        if os.getenv('HOURLY_MODE'):
+            # Cada hora en UTC; la función elige las zonas donde son las SEND_HOUR
+            schedulers = [('birthday-reminder-job', '0 * * * *', '{"mode": "hourly"}', 'Etc/UTC')]
+        else:
+            schedulers = [('birthday-reminder-job', '0 8 * * *', 'Check birthdays')]
+        if os.getenv('SNAPSHOT_BUCKET'):
+            # Pregenerar en la noche los mensajes de los próximos días; con
+            # SNAPSHOT_DIR quedarían en el disco de la instancia que corrió el job
+            schedulers.append(('birthday-pregenerate-job', '0 20 * * *', '{"mode": "pregenerate"}'))
+        with ThreadPoolExecutor(1 + len(schedulers)) as pool:
+            deployed = pool.submit(
+                deploy_function, deploy_path, env_vars, creds,
+                None if force else deployed_hash.result()
+            )
+            existing = {} if force else jobs.result()
+            for job in [pool.submit(create_scheduler, *job, existing=existing) for job in schedulers]:
+                job.result()
+            deployed.result()
     
     # Limpiar
     cleanup(deploy_path)
     print("Deploy finalizado")
 
 if __name__ == '__main__':
-    main()
+    main(force='--force' in sys.argv[1:])
@@ -1,17 +1,51 @@
 import os
 import sys
 import json
+import time
+import base64
 import logging
-from google.oauth2 import service_account
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-import google.generativeai as genai
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+_MODULE_START = time.perf_counter()
+
+# Las dependencias pesadas (googleapiclient, Secret Manager, Gemini, pandas)
+# se importan bajo demanda con timed_import para acortar el arranque en frío.
+import metrics
+import ratelimit
 from utils import (
-    Config, process_birthdays
+    Config, Lazy, IMPORT_TIMES, timed_import, load_birthday_index, process_birthdays,
+    resume_birthdays
 )
 
-from google.cloud import secretmanager
-from google.auth.transport.requests import Request
+MODULE_IMPORT_TIME = time.perf_counter() - _MODULE_START
+_import_report_logged = False
+
+# Segundos de trabajo por invocación, por debajo del --timeout de 60s: al
+# vencer se guarda un punto de control y se publica un mensaje para continuar
+RUN_BUDGET_SECONDS = float(os.getenv('RUN_BUDGET_SECONDS', '45'))
+MAX_CONTINUATIONS = int(os.getenv('MAX_CONTINUATIONS', '10'))
+
+SECRET_IDS = [
+    'birthday-reminder-sa', 'gmail-client-secret', 'gmail-refresh-token', 'gemini-api-key'
+]
+# Caché de secretos a nivel de módulo: sobrevive entre invocaciones de una
+# instancia caliente. secret_id -> (valor, instante de lectura)
+SECRET_TTL_SECONDS = int(os.getenv('SECRET_TTL_SECONDS', '600'))
+_secret_cache = {}
+_secret_lock = threading.Lock()
+_secret_client = None
+
+# Credenciales y clientes de API reutilizados en instancias calientes. Las
+# credenciales se reconstruyen con el mismo TTL que los secretos de los que
+# salen: api_name -> (credenciales, instante de creación)
+_clients = {}
+_credentials = {}
+_clients_lock = threading.Lock()
+_shared_http = None
+_auth_request = None
+_gemini_configured_at = None
 
 def setup_logging():
     logger = logging.getLogger()       # logger raíz
@@ -29,82 +63,467 @@ def setup_logging():
     logger.handlers = [stream_handler]
 
 
+def log_import_report():
+    """Registra una vez por instancia cuánto tardaron las importaciones."""
+    global _import_report_logged
+    if _import_report_logged:
+        return
+    _import_report_logged = True
+    report = {name: round(seconds, 3) for name, seconds in IMPORT_TIMES.items()}
+    logging.info(
+        f"Importación del módulo: {MODULE_IMPORT_TIME:.3f}s; "
+        f"importaciones bajo demanda: {json.dumps(report)}"
+    )
+
+def build_service(api_name, api_version, http):
+    """Construye el cliente de la API con el documento de discovery local.
+
+    google-api-python-client incluye los documentos de discovery, así que
+    static_discovery evita pedirlos por red y cache_discovery=False evita
+    buscar una caché en disco en cada arranque.
+    """
+    discovery = timed_import('googleapiclient.discovery')
+    return discovery.build(
+        api_name, api_version, http=http,
+        static_discovery=True, cache_discovery=False
+    )
+
+def get_shared_http():
+    """Transporte httplib2 compartido por Sheets y Gmail.
+
+    httplib2 mantiene abiertas las conexiones por host, así que reutilizar
+    el mismo objeto entre invocaciones evita repetir el handshake TCP/TLS.
+    """
+    global _shared_http
+    if _shared_http is None:
+        _shared_http = timed_import('httplib2').Http(timeout=30)
+    return _shared_http
+
+def get_auth_request():
+    """Transporte compartido para refrescar credenciales."""
+    global _auth_request
+    if _auth_request is None:
+        requests = timed_import('google.auth.transport.requests')
+        _auth_request = requests.Request()
+    return _auth_request
+
+def get_secret_client():
+    """Devuelve el cliente de Secret Manager compartido por toda la instancia."""
+    global _secret_client
+    with _secret_lock:
+        if _secret_client is None:
+            secretmanager = timed_import('google.cloud.secretmanager')
+            _secret_client = secretmanager.SecretManagerServiceClient()
+    return _secret_client
+
+def _secret_path(secret_id):
+    return f"projects/{os.getenv('PROJECT_ID')}/secrets/{secret_id}"
+
+def _cached_secret(secret_id):
+    entry = _secret_cache.get(secret_id)
+    if entry and time.monotonic() - entry[1] < SECRET_TTL_SECONDS:
+        return entry[0]
+    return None
+
 def get_secret(secret_id):
-    """Obtiene un secreto de Secret Manager."""
-    client = secretmanager.SecretManagerServiceClient()
-    name = f"projects/{os.getenv('PROJECT_ID')}/secrets/{secret_id}/versions/latest"
-    response = client.access_secret_version(request={"name": name})
-    return response.payload.data.decode("UTF-8")
-
-def get_google_service(api_name, api_version, scopes):
-    """Obtiene servicio de Google API usando las credenciales apropiadas."""
+    """Obtiene un secreto de Secret Manager, usando la caché si está vigente."""
+    value = _cached_secret(secret_id)
+    if value is not None:
+        return value
+    response = get_secret_client().access_secret_version(
+        request={"name": f"{_secret_path(secret_id)}/versions/latest"}
+    )
+    value = response.payload.data.decode("UTF-8")
+    _secret_cache[secret_id] = (value, time.monotonic())
+    return value
+
+def prefetch_secrets(secret_ids=SECRET_IDS):
+    """Lee en paralelo los secretos que no estén en caché."""
+    missing = [secret_id for secret_id in secret_ids if _cached_secret(secret_id) is None]
+    if not missing:
+        return
+    get_secret_client()
+    with ThreadPoolExecutor(len(missing)) as pool:
+        list(pool.map(get_secret, missing))
+
+def update_secret(secret_id, value):
+    """Agrega una nueva versión del secreto y actualiza la caché."""
+    get_secret_client().add_secret_version(
+        request={
+            "parent": _secret_path(secret_id),
+            "payload": {"data": value.encode("UTF-8")}
+        }
+    )
+    _secret_cache[secret_id] = (value, time.monotonic())
+
+def get_credentials(api_name, scopes):
+    """Construye las credenciales apropiadas para la API."""
     if api_name == 'gmail':
         # Para Gmail usamos OAuth
+        Credentials = timed_import('google.oauth2.credentials').Credentials
         client_secret = json.loads(get_secret('gmail-client-secret'))
-        refresh_token = get_secret('gmail-refresh-token')
+        refresh_token = json.loads(get_secret('gmail-refresh-token'))['refresh_token']
         client_id = os.getenv('GMAIL_CLIENT_ID')
         
-        creds = Credentials.from_authorized_user_info({
+        return Credentials.from_authorized_user_info({
             'client_id': client_id,
             'client_secret': client_secret['installed']['client_secret'],
-            'refresh_token': json.loads(refresh_token)['refresh_token'],
+            'refresh_token': refresh_token,
             'token_uri': 'https://oauth2.googleapis.com/token'
         }, scopes)
-        # Refrescar el token en cada ejecución si hay refresh_token
-        if creds and creds.refresh_token:
-            creds.refresh(Request())
-            # Guardar el nuevo token en Secret Manager
-            client = secretmanager.SecretManagerServiceClient()
-            parent = f"projects/{os.getenv('PROJECT_ID')}/secrets/gmail-refresh-token"
-            payload = creds.to_json().encode("UTF-8")
-            client.add_secret_version(
-                request={
-                    "parent": parent,
-                    "payload": {"data": payload}
-                }
-            )
-            logging.debug("Token de Gmail actualizado y guardado en Secret Manager")
+    # Para otros servicios usamos service account
+    service_account = timed_import('google.oauth2.service_account')
+    service_account_info = json.loads(get_secret('birthday-reminder-sa'))
+    return service_account.Credentials.from_service_account_info(
+        service_account_info,
+        scopes=scopes
+    )
+
+def refresh_credentials(api_name, creds):
+    """Refresca credenciales vencidas; guarda el token de Gmail si rotó."""
+    previous_refresh_token = getattr(creds, 'refresh_token', None)
+    creds.refresh(get_auth_request())
+    if api_name == 'gmail' and creds.refresh_token != previous_refresh_token:
+        # Guardar el token en Secret Manager solo si Google lo rotó
+        update_secret('gmail-refresh-token', creds.to_json())
+        logging.debug("Token de Gmail actualizado y guardado en Secret Manager")
+
+def get_google_service(api_name, api_version, scopes, slot=0):
+    """Obtiene servicio de Google API usando las credenciales apropiadas.
+
+    El servicio y sus credenciales se guardan a nivel de módulo: en una
+    instancia caliente solo se refrescan las credenciales cuando vencen, y
+    se vuelven a construir desde los secretos cuando pasa SECRET_TTL_SECONDS,
+    así una rotación del secreto llega a las instancias calientes.
+    httplib2 no es seguro entre hilos, así que cada hilo que procese una
+    hoja en paralelo usa su propio slot, con su propio transporte HTTP.
+    """
+    key = (api_name, api_version, slot)
+    with _clients_lock:
+        cached = _credentials.get(api_name)
+        if cached is None or time.monotonic() - cached[1] >= SECRET_TTL_SECONDS:
+            cached = _credentials[api_name] = (get_credentials(api_name, scopes), time.monotonic())
+        entry = _clients.get(key)
+        if entry is None or entry[1] is not cached[0]:
+            google_auth_httplib2 = timed_import('google_auth_httplib2')
+            creds = cached[0]
+            base_http = get_shared_http() if slot == 0 else timed_import('httplib2').Http(timeout=30)
+            http = google_auth_httplib2.AuthorizedHttp(creds, http=base_http)
+            entry = _clients[key] = (build_service(api_name, api_version, http), creds)
+        service, creds = entry
+        if not creds.valid:
+            refresh_credentials(api_name, creds)
+        else:
+            logging.debug(f"Reutilizando cliente de {api_name}, token vigente hasta {creds.expiry}")
+    return service
+
+def configure_gemini():
+    """Configura Gemini una vez por instancia y de nuevo cuando vence la clave en caché."""
+    global _gemini_configured_at
+    if _gemini_configured_at is None or time.monotonic() - _gemini_configured_at >= SECRET_TTL_SECONDS:
+        timed_import('google.generativeai').configure(api_key=get_secret('gemini-api-key'))
+        _gemini_configured_at = time.monotonic()
+
+def parse_event_payload(event):
+    """Decodifica el mensaje de Pub/Sub; devuelve {} si no es un objeto JSON."""
+    data = (event or {}).get('data')
+    if not data:
+        return {}
+    try:
+        payload = json.loads(base64.b64decode(data).decode('utf-8'))
+    except ValueError:
+        return {}
+    return payload if isinstance(payload, dict) else {}
+
+def get_store():
+    """Almacén para instantáneas y mensajes pregenerados, si está configurado.
+
+    SNAPSHOT_BUCKET guarda los datos en Cloud Storage (sobreviven a los
+    arranques en frío); SNAPSHOT_DIR los guarda en un directorio local.
+    """
+    bucket = os.getenv('SNAPSHOT_BUCKET')
+    directory = os.getenv('SNAPSHOT_DIR')
+    if not bucket and not directory:
+        return None
+    snapshot = timed_import('snapshot')
+    return snapshot.GCSSnapshotStore(bucket) if bucket else snapshot.LocalSnapshotStore(directory)
+
+def get_index_loader(store, slot=0):
+    """Devuelve el cargador de instantáneas de contactos para el almacén."""
+    if store is None:
+        return None
+    drive_service = get_google_service(
+        'drive', 'v3',
+        ['https://www.googleapis.com/auth/drive.metadata.readonly'],
+        slot
+    )
+    return timed_import('snapshot').SnapshotIndexLoader(store, drive_service)
+
+def get_outbox(store, spreadsheet_id):
+    """Registro de envíos como JSON en el almacén, o None si no hay almacén.
+
+    No se usa SQLite (OUTBOX_DB): el disco de una instancia es temporal y no
+    se comparte, así que cada instancia vería un registro distinto.
+    """
+    if store is None:
+        return None
+    return timed_import('outbox').StoreOutbox(store, key=f"outbox-{spreadsheet_id}")
+
+def get_targets(payload):
+    """Hojas a procesar según el mensaje de Pub/Sub.
+
+    El mensaje puede traer "spreadsheets": una lista de ids o de objetos
+    {"id", "range"}; si no, se usa la variable SPREADSHEETS (misma forma, en
+    JSON) o SPREADSHEET_ID. Con "shard": {"index", "count"} solo se procesa
+    la porción index de count en que se reparte la lista.
+    """
+    targets = payload.get('spreadsheets') or json.loads(os.getenv('SPREADSHEETS') or 'null')
+    targets = targets or [os.getenv('SPREADSHEET_ID')]
+    targets = [
+        target if isinstance(target, dict) else {'id': target}
+        for target in targets
+    ]
+    for target in targets:
+        target.setdefault('range', 'Hoja1!A:E')
+    shard = payload.get('shard')
+    if shard:
+        targets = targets[shard['index']::shard['count']]
+    return targets
+
+def publish_messages(payloads):
+    """Publica los mensajes en el topic de la función y espera la confirmación."""
+    pubsub_v1 = timed_import('google.cloud.pubsub_v1')
+    publisher = pubsub_v1.PublisherClient()
+    topic = publisher.topic_path(os.getenv('PROJECT_ID'), os.getenv('TOPIC', 'birthday-reminder'))
+    futures = [
+        publisher.publish(topic, json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8'))
+        for payload in payloads
+    ]
+    for future in futures:
+        future.result()
+
+def publish_shards(targets, shard_count, payload):
+    """Reparte las hojas en shard_count mensajes publicados al mismo topic.
+
+    Cada mensaje conserva el resto de payload (mode, hour, days, ...), así
+    que cada shard se procesa en el mismo modo que el mensaje original.
+    """
+    publish_messages([
+        {**payload, 'spreadsheets': targets, 'shard': {'index': index, 'count': shard_count}}
+        for index in range(shard_count)
+    ])
+    logging.info(f"{len(targets)} hojas repartidas en {shard_count} mensajes")
+
+def continue_later(target, payload, store, results, previous=None):
+    """Guarda el punto de control y publica un mensaje que continúa la ejecución.
+
+    Con almacén configurado el estado se guarda ahí y el mensaje solo lleva
+    su clave; si no, el estado viaja dentro del mensaje.
+    """
+    checkpoint = timed_import('checkpoint')
+    count = int(payload.get('continuacion', 0)) + 1
+    if count > MAX_CONTINUATIONS:
+        logging.error(
+            f"Se alcanzó el máximo de {MAX_CONTINUATIONS} continuaciones para la hoja "
+            f"{target['id']}; {len(results['pendientes'])} personas quedan sin procesar"
+        )
+        return
+    state = checkpoint.dump_checkpoint(results, previous)
+    message = {'mode': 'continue', 'spreadsheets': [target], 'continuacion': count}
+    if store is not None:
+        key = checkpoint.checkpoint_key(target['id'])
+        checkpoint.save_checkpoint(store, key, state)
+        message['checkpoint'] = key
     else:
-        # Para otros servicios usamos service account
-        service_account_info = json.loads(get_secret('birthday-reminder-sa'))
-        creds = service_account.Credentials.from_service_account_info(
-            service_account_info,
-            scopes=scopes
+        message['estado'] = state
+    with metrics.span('continuacion'):
+        publish_messages([message])
+    metrics.incr('continuaciones_publicadas')
+    logging.info(
+        f"Continuación {count} publicada con {len(results['pendientes'])} personas pendientes"
+    )
+
+def retry_later(target, payload):
+    """Publica de nuevo el mensaje para la hoja cuando no alcanzó el tiempo
+    ni para leerla: aún no hay personas pendientes que guardar."""
+    count = int(payload.get('continuacion', 0)) + 1
+    if count > MAX_CONTINUATIONS:
+        logging.error(
+            f"Se alcanzó el máximo de {MAX_CONTINUATIONS} continuaciones para la hoja "
+            f"{target['id']} sin terminar de leerla"
+        )
+        return
+    message = {key: value for key, value in payload.items() if key != 'shard'}
+    message.update(spreadsheets=[target], continuacion=count)
+    with metrics.span('continuacion'):
+        publish_messages([message])
+    metrics.incr('continuaciones_publicadas')
+    logging.warning(f"Tiempo agotado al leer la hoja {target['id']}; reintento {count} publicado")
+
+def build_config(target, store, slot=0, deadline=None):
+    """Configuración para procesar una hoja."""
+    config = Config()
+    config.spreadsheet_id = target['id']
+    config.range_name = target['range']
+    config.deadline = deadline
+    if os.getenv('FAST_STARTUP') and config.sheet_reader == 'pandas':
+        # Sin pandas: la hoja se lee por páginas
+        config.sheet_reader = 'stream'
+    config.index_loader = get_index_loader(store, slot)
+    if store is not None:
+        config.message_cache = timed_import('message_cache').MessageCache(
+            store, key=f"messages-{target['id']}"
         )
-    return build(api_name, api_version, credentials=creds)
+    config.outbox = get_outbox(store, target['id'])
+    # Gemini solo se configura si hay cumpleaños que procesar
+    config.gemini_setup = Lazy(configure_gemini)
+    return config
+
+def process_target(target, payload, store, slot=0, deadline=None):
+    """Procesa una hoja: envía los cumpleaños del día o pregenera mensajes.
+
+    Con el modo continue retoma las personas pendientes de una ejecución que
+    agotó su tiempo (ver continue_later).
+    """
+    config = build_config(target, store, slot, deadline)
+
+    # Obtener servicios de Google
+    with metrics.span('servicio.sheets'):
+        sheets_service = get_google_service(
+            'sheets', 'v4', 
+            ['https://www.googleapis.com/auth/spreadsheets.readonly'],
+            slot
+        )
+    gmail_service = Lazy(lambda: get_google_service(
+        'gmail', 'v1',
+        ['https://www.googleapis.com/auth/gmail.send'],
+        slot
+    ))
+
+    if payload.get('mode') == 'pregenerate':
+        # Generar con anticipación los mensajes de los próximos días
+        if config.message_cache is None:
+            logging.error("El modo pregenerate requiere SNAPSHOT_BUCKET o SNAPSHOT_DIR")
+            return
+        try:
+            index = load_birthday_index(sheets_service, config)
+        except ratelimit.DeadlineExceeded:
+            retry_later(target, payload)
+            return
+        timed_import('message_cache').pregenerate_messages(
+            index, config.message_cache, config, days=payload.get('days')
+        )
+        return
+
+    if payload.get('mode') == 'hourly':
+        # Trigger cada hora: solo las zonas horarias donde ahora es la hora de envío
+        config.send_hour = int(payload.get('hour', os.getenv('SEND_HOUR', '8')))
+        if not os.getenv('SNAPSHOT_BUCKET'):
+            logging.warning(
+                "Modo por hora sin SNAPSHOT_BUCKET: sin instantánea compartida entre "
+                "instancias la hoja se lee completa en cada ejecución"
+            )
+
+    from_email = target.get('from_email') or os.getenv('YOUR_EMAIL')
+    if payload.get('mode') == 'continue':
+        # Retomar exactamente las personas pendientes de la ejecución anterior
+        checkpoint = timed_import('checkpoint')
+        key = payload.get('checkpoint')
+        state = checkpoint.load_checkpoint(store, key) if key and store else payload.get('estado')
+        if not state:
+            logging.error(f"Punto de control {key} no encontrado, no se puede continuar")
+            return
+        results = resume_birthdays(
+            checkpoint.pending_from(state), gmail_service, config, from_email
+        )
+        if results['pendientes']:
+            continue_later(target, payload, store, results, state)
+        if key and store:
+            store.delete(key)
+        return
+
+    # Procesar cumpleaños
+    try:
+        results = process_birthdays(sheets_service, gmail_service, config, from_email)
+    except ratelimit.DeadlineExceeded:
+        retry_later(target, payload)
+        return
+    if results and results.get('pendientes'):
+        continue_later(target, payload, store, results)
+
+def process_targets(targets, payload, store, deadline=None):
+    """Procesa varias hojas en paralelo, cada hilo con su propio slot de clientes."""
+    workers = max(1, min(len(targets), int(os.getenv('FANOUT_WORKERS', '4'))))
+
+    def process(target, slot=0):
+        # El error de una hoja no impide procesar las demás
+        try:
+            process_target(target, payload, store, slot, deadline)
+        except Exception:
+            logging.exception(f"Error al procesar la hoja {target['id']}")
+
+    if workers == 1:
+        for target in targets:
+            process(target)
+        return
+
+    slots = queue.Queue()
+    for slot in range(workers):
+        slots.put(slot)
+
+    def run(target):
+        slot = slots.get()
+        try:
+            process(target, slot)
+        finally:
+            slots.put(slot)
+
+    with ThreadPoolExecutor(workers) as pool:
+        list(pool.map(metrics.bind(run), targets))
 
 def birthday_reminder(event, context=None):
     """Función principal para Google Cloud Functions."""
     setup_logging()
+    run = metrics.start_run('birthday_reminder')
+    try:
+        with metrics.profile_run():
+            return _birthday_reminder(event)
+    finally:
+        run.extra['importaciones_s'] = {
+            name: round(seconds, 3) for name, seconds in IMPORT_TIMES.items()
+        }
+        metrics.emit_summary()
+
+def _birthday_reminder(event):
     # Log de inicio
     logging.debug("Birthday reminder iniciando ejecución")
+    deadline = time.monotonic() + RUN_BUDGET_SECONDS
 
     # Verificar variables de entorno
-    for var in ['PROJECT_ID', 'SPREADSHEET_ID', 'YOUR_EMAIL', 'GMAIL_CLIENT_ID']:
+    required = ['PROJECT_ID', 'YOUR_EMAIL', 'GMAIL_CLIENT_ID']
+    if not os.getenv('SPREADSHEETS'):
+        required.append('SPREADSHEET_ID')
+    for var in required:
         value = os.getenv(var)
         if not value:
             logging.error(f"Variable de entorno {var} no encontrada")
         else:
             logging.debug(f"Variable {var} encontrada")
 
-    # Configurar APIs
-    config = Config()
-    config.spreadsheet_id = os.getenv('SPREADSHEET_ID')
-    config.range_name = 'Hoja1!A:E'
-    genai.configure(api_key=get_secret('gemini-api-key'))
+    payload = parse_event_payload(event)
+    targets = get_targets(payload)
+    fanout = payload.get('fanout') or os.getenv('FANOUT_MODE', 'threads')
+    if fanout == 'publish' and 'shard' not in payload and len(targets) > 1:
+        # Cada shard se procesa en otra invocación, en paralelo
+        shard_count = min(len(targets), int(os.getenv('FANOUT_SHARDS', str(len(targets)))))
+        publish_shards(targets, shard_count, payload)
+        return 'OK'
 
-    # Obtener servicios de Google
-    sheets_service = get_google_service(
-        'sheets', 'v4', 
-        ['https://www.googleapis.com/auth/spreadsheets.readonly']
-    )
-    gmail_service = get_google_service(
-        'gmail', 'v1',
-        ['https://www.googleapis.com/auth/gmail.send']
-    )
+    # Leer todos los secretos en una sola pasada concurrente
+    with metrics.span('secretos'):
+        prefetch_secrets()
 
-    # Procesar cumpleaños
-    from_email = os.getenv('YOUR_EMAIL')
-    process_birthdays(sheets_service, gmail_service, config, from_email)
+    process_targets(targets, payload, get_store(), deadline)
+    log_import_report()
 
     return 'OK'
@@ -8,6 +8,8 @@ import google.generativeai as genai
 from utils import (
     Config, setup_logging, process_birthdays
 )
+from outbox import SQLiteOutbox
+import metrics
 
 def get_google_service(api_name, api_version, scopes, token_path):
     """Obtiene servicio de Google API usando OAuth2 para autenticación local."""
@@ -37,6 +39,8 @@ def main():
     config = Config()
     config.spreadsheet_id = os.getenv('SPREADSHEET_ID')
     config.range_name = 'Hoja1!A:E'
+    if os.getenv('OUTBOX_DB'):
+        config.outbox = SQLiteOutbox(os.getenv('OUTBOX_DB'))
     genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
 
     # Obtener servicios de Google
@@ -53,7 +57,12 @@ def main():
 
     # Procesar cumpleaños
     from_email = os.getenv('YOUR_EMAIL')
-    process_birthdays(sheets_service, gmail_service, config, from_email)
+    metrics.start_run('main')
+    try:
+        with metrics.profile_run():
+            process_birthdays(sheets_service, gmail_service, config, from_email)
+    finally:
+        metrics.emit_summary()
 
 if __name__ == '__main__':
     main()
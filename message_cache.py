@@ -0,0 +1,152 @@
+import json
+import hashlib
+import datetime
+import logging
+import threading
+import ratelimit
+from utils import (
+    build_birthday_prompt, out_of_time, request_birthday_message, request_birthday_messages,
+    resolve, today_in, work_deadline
+)
+
+class MessageCache:
+    """Mensajes de cumpleaños pregenerados, persistidos en un almacén.
+
+    Cada entrada se identifica por contacto, fecha del cumpleaños y prompt,
+    de modo que si cambian los datos de la persona el mensaje no se reutiliza.
+    El almacén es cualquier objeto con read(key) y write(key, data), como
+    los de snapshot.py. Los datos se leen la primera vez que se consultan.
+    """
+    def __init__(self, store, key='messages'):
+        self.store = store
+        self.key = key
+        self._entries = None
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def entry_key(person, date):
+        contact = f"{person.get('nombre')}|{person.get('correo electrónico')}"
+        prompt = build_birthday_prompt(person)
+        digest = hashlib.sha256(f"{contact}|{date.isoformat()}|{prompt}".encode('utf-8'))
+        return digest.hexdigest()
+
+    def _load(self):
+        if self._entries is None:
+            data = self.store.read(self.key)
+            self._entries = json.loads(data.decode('utf-8')) if data else {}
+        return self._entries
+
+    def __contains__(self, item):
+        person, date = item
+        with self._lock:
+            return self.entry_key(person, date) in self._load()
+
+    def put(self, person, date, message):
+        with self._lock:
+            self._load()[self.entry_key(person, date)] = {
+                'fecha': date.isoformat(), 'mensaje': message
+            }
+            self._dirty = True
+
+    def peek(self, person, date):
+        """Devuelve el mensaje pregenerado sin eliminarlo, o None si no existe.
+
+        El mensaje se elimina con discard() una vez enviado: si el envío falla
+        sigue disponible para el reintento.
+        """
+        with self._lock:
+            entry = self._load().get(self.entry_key(person, date))
+            return None if entry is None else entry['mensaje']
+
+    def discard(self, person, date):
+        """Elimina el mensaje pregenerado de la persona, si existe."""
+        with self._lock:
+            if self._load().pop(self.entry_key(person, date), None) is not None:
+                self._dirty = True
+
+    def evict_before(self, date):
+        """Elimina los mensajes de fechas anteriores a la dada.
+
+        Para no borrar mensajes que alguna zona horaria aún no envió, date
+        debe ser earliest_local_date() y no la fecha de una zona.
+        """
+        with self._lock:
+            entries = self._load()
+            stale = [key for key, entry in entries.items() if entry['fecha'] < date.isoformat()]
+            for key in stale:
+                del entries[key]
+            self._dirty = self._dirty or bool(stale)
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            self.store.write(self.key, json.dumps(self._entries, ensure_ascii=False).encode('utf-8'))
+            self._dirty = False
+
+def earliest_local_date(now=None):
+    """Fecha más atrasada del planeta: la de UTC-12 (Etc/GMT+12).
+
+    Ninguna zona horaria tiene una fecha local anterior, así que los
+    mensajes de fechas previas ya no los necesita nadie.
+    """
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    return (now - datetime.timedelta(hours=12)).date()
+
+def pregenerate_messages(index, cache, config, start=None, days=None):
+    """Genera con anticipación los mensajes de los próximos días.
+
+    Recorre el índice desde start (hoy en config.timezone por defecto)
+    durante days días (config.lookahead_days por defecto) y guarda en la
+    caché los mensajes que aún no existan. Si Gemini falla no se guarda nada para esa persona: el
+    envío del día lo intentará de nuevo. Solo descarta los mensajes de
+    fechas que ya pasaron en todas las zonas horarias. Con config.deadline
+    se detiene al llegar a work_deadline y guarda lo generado hasta ahí.
+    Devuelve cuántos mensajes generó.
+    """
+    start = start or today_in(config.timezone)
+    days = config.lookahead_days if days is None else days
+    cache.evict_before(earliest_local_date())
+    missing = []
+    end = start + datetime.timedelta(days=days - 1)
+    for date, person in index.birthdays_between(start, end):
+        if not person.get('correo electrónico') or not person.get('nombre'):
+            continue
+        if (person, date) not in cache:
+            missing.append((person, date))
+
+    deadline = work_deadline(config)
+    generated = 0
+    group_size = max(1, config.gemini_batch_size)
+    try:
+        for begin in range(0, len(missing), group_size):
+            if out_of_time(config):
+                raise ratelimit.DeadlineExceeded("plazo de la ejecución")
+            group = missing[begin:begin + group_size]
+            resolve(config.gemini_setup)
+            try:
+                messages = request_birthday_messages([person for person, _ in group], deadline)
+            except ratelimit.DeadlineExceeded:
+                raise
+            except Exception:
+                logging.exception("Error al pregenerar mensajes agrupados con Gemini")
+                messages = [None] * len(group)
+            for (person, date), message in zip(group, messages):
+                if message is None:
+                    try:
+                        message = request_birthday_message(build_birthday_prompt(person), deadline)
+                    except ratelimit.DeadlineExceeded:
+                        raise
+                    except Exception:
+                        logging.exception(f"Error al pregenerar el mensaje para {person.get('nombre')}")
+                        continue
+                cache.put(person, date, message)
+                generated += 1
+    except ratelimit.DeadlineExceeded:
+        logging.warning(
+            f"Tiempo agotado al pregenerar: {len(missing) - generated} mensajes se generarán al enviar"
+        )
+    cache.save()
+    logging.info(f"Mensajes pregenerados para los próximos {days} días: {generated}")
+    return generated
@@ -0,0 +1,182 @@
+import os
+import io
+import sys
+import json
+import time
+import pstats
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+class RunMetrics:
+    """Tiempos por etapa y contadores de una ejecución del bot.
+
+    Los spans acumulan llamadas, tiempo total y máximo por nombre; los
+    contadores se pueden incrementar desde cualquier hilo.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.counters = {}
+        self.spans = {}
+        self.extra = {}
+        self.profilers = None  # lista de cProfile.Profile de los hilos si PROFILE=cprofile
+        self._lock = threading.Lock()
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def record_span(self, name, seconds):
+        with self._lock:
+            span = self.spans.setdefault(name, {'llamadas': 0, 'total_s': 0.0, 'max_s': 0.0})
+            span['llamadas'] += 1
+            span['total_s'] += seconds
+            span['max_s'] = max(span['max_s'], seconds)
+
+    def summary(self):
+        with self._lock:
+            return {
+                'ejecucion': self.name,
+                'duracion_s': round(time.perf_counter() - self.started, 4),
+                'contadores': dict(self.counters),
+                'etapas': {
+                    name: {key: round(value, 4) for key, value in span.items()}
+                    for name, span in self.spans.items()
+                },
+                **self.extra,
+            }
+
+# Ejecución actual en una contextvar: dos invocaciones concurrentes en la
+# misma instancia no mezclan sus métricas. Los hilos nuevos no heredan el
+# contexto, así que las tareas de un pool se envuelven con bind().
+_current = contextvars.ContextVar('metrics_run', default=RunMetrics('sin ejecución'))
+
+def start_run(name):
+    """Empieza a medir una nueva ejecución y la deja como la actual."""
+    run = RunMetrics(name)
+    _current.set(run)
+    return run
+
+def current():
+    return _current.get()
+
+def incr(name, value=1):
+    _current.get().incr(name, value)
+
+def bind(function):
+    """Envuelve function para que corra en otro hilo con la ejecución actual.
+
+    Si la ejecución se está perfilando con cProfile, el hilo se perfila con
+    su propio profiler y su resultado se suma al de la ejecución.
+    """
+    run = _current.get()
+
+    def bound(*args, **kwargs):
+        token = _current.set(run)
+        profiler = _thread_profiler(run)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            _current.reset(token)
+    return bound
+
+def _thread_profiler(run):
+    if run.profilers is None:
+        return None
+    import cProfile
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:  # desde Python 3.12 solo puede haber un profiler activo
+        return None
+    with run._lock:
+        run.profilers.append(profiler)
+    return profiler
+
+@contextmanager
+def span(name):
+    """Mide el tiempo del bloque y lo acumula en el span name."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _current.get().record_span(name, time.perf_counter() - start)
+
+def emit_summary(stream=None):
+    """Escribe el resumen de la ejecución como una sola línea JSON.
+
+    Cloud Logging interpreta las líneas JSON de stdout como registros
+    estructurados (jsonPayload), con el nivel tomado del campo severity.
+    """
+    run = _current.get()
+    summary = run.summary()
+    line = json.dumps(
+        {'severity': 'INFO', 'message': f"Resumen de ejecución {run.name}", **summary},
+        ensure_ascii=False
+    )
+    stream = stream or sys.stdout
+    stream.write(line + '\n')
+    stream.flush()
+    return summary
+
+@contextmanager
+def profile_run():
+    """Perfila el bloque si PROFILE vale 'cprofile' o 'tracemalloc'.
+
+    El volcado completo se guarda en PROFILE_DIR (/tmp por defecto) y un
+    resumen de lo más costoso se agrega al resumen de la ejecución.
+    cProfile solo mide el hilo que lo activa: los hilos de los pools que
+    corren tareas envueltas con bind() se perfilan aparte y se suman al
+    volcado. tracemalloc mide la memoria de todo el proceso, así que con
+    invocaciones concurrentes en la instancia incluye la de las demás.
+    """
+    mode = os.getenv('PROFILE', '').lower()
+    directory = os.getenv('PROFILE_DIR', '/tmp')
+    stamp = f"{time.strftime('%Y%m%d-%H%M%S')}-{threading.get_ident()}"  # único por invocación
+    run = _current.get()
+    if mode == 'cprofile':
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        run.profilers = []
+        try:
+            yield
+        finally:
+            profiler.disable()
+            with run._lock:
+                thread_profilers, run.profilers = run.profilers, None
+            stats = pstats.Stats(profiler)
+            for thread_profiler in thread_profilers:
+                stats.add(thread_profiler)
+            path = os.path.join(directory, f"birthday-bot-{stamp}.prof")
+            stats.dump_stats(path)
+            report = io.StringIO()
+            stats.stream = report
+            stats.sort_stats('cumulative').print_stats(20)
+            logging.info(
+                f"Perfil cProfile de {1 + len(thread_profilers)} hilos guardado en {path}\n"
+                f"{report.getvalue()}"
+            )
+            run.extra['perfil'] = path
+    elif mode == 'tracemalloc':
+        import tracemalloc
+        tracemalloc.start(10)
+        try:
+            yield
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            path = os.path.join(directory, f"birthday-bot-{stamp}.tracemalloc")
+            snapshot.dump(path)
+            run.extra['perfil'] = path
+            run.extra['memoria_pico_mb'] = round(peak / 2 ** 20, 2)
+            run.extra['memoria_top'] = [
+                str(stat) for stat in snapshot.statistics('lineno')[:10]
+            ]
+    else:
+        yield
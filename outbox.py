@@ -0,0 +1,260 @@
+import json
+import sqlite3
+import hashlib
+import datetime
+import threading
+
+PENDING = 'pendiente'
+SENDING = 'enviando'
+SENT = 'enviado'
+
+# Contenido del objeto de reserva de un correo ya enviado (ver StoreOutbox)
+SENT_MARKER = SENT.encode('utf-8')
+
+# Segundos tras los que un envío reservado y nunca confirmado (la ejecución
+# murió a mitad del envío) puede volver a reservarse
+CLAIM_LEASE_SECONDS = 300
+
+def contact_key(person):
+    """Identificador estable del contacto para el registro de envíos."""
+    correo = (person.get('correo electrónico') or '').strip().lower()
+    return f"{correo}|{person.get('nombre')}"
+
+class SQLiteOutbox:
+    """Bandeja de salida y registro de envíos en una base SQLite.
+
+    Cada mensaje generado se guarda como pendiente antes de enviarlo y se
+    marca como enviado al confirmarse, con clave (contacto, fecha). Si el
+    trigger se repite, los enviados se omiten y los pendientes se envían
+    con el mensaje ya generado, sin volver a llamar a Gemini. Justo antes de
+    enviar, claim() reserva la entrada en una sola operación, así que dos
+    ejecuciones simultáneas no envían el mismo correo.
+
+    Cualquier objeto con los métodos get, enqueue, claim, mark_sent,
+    mark_failed y flush puede usarse como config.outbox (ver StoreOutbox).
+    """
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS outbox ('
+                ' contacto TEXT NOT NULL,'
+                ' fecha TEXT NOT NULL,'
+                ' mensaje TEXT NOT NULL,'
+                ' estado TEXT NOT NULL,'
+                ' intentos INTEGER NOT NULL DEFAULT 0,'
+                ' error TEXT,'
+                ' actualizado TEXT NOT NULL,'
+                ' PRIMARY KEY (contacto, fecha))'
+            )
+
+    def _execute(self, sql, params):
+        with self._lock, self._conn:
+            return self._conn.execute(sql, params).fetchone()
+
+    def get(self, person, date):
+        """Devuelve {'estado', 'mensaje'} del envío, o None si no existe."""
+        row = self._execute(
+            'SELECT estado, mensaje FROM outbox WHERE contacto = ? AND fecha = ?',
+            (contact_key(person), date.isoformat())
+        )
+        return {'estado': row[0], 'mensaje': row[1]} if row else None
+
+    def enqueue(self, person, date, message):
+        self._execute(
+            'INSERT OR IGNORE INTO outbox (contacto, fecha, mensaje, estado, actualizado)'
+            ' VALUES (?, ?, ?, ?, ?)',
+            (contact_key(person), date.isoformat(), message, PENDING, _now())
+        )
+
+    def claim(self, person, date, message):
+        """Reserva el envío: lo inserta o lo pasa a enviando si estaba pendiente.
+
+        Devuelve False si ya se envió o si otra ejecución lo reservó hace
+        menos de CLAIM_LEASE_SECONDS.
+        """
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                'INSERT INTO outbox (contacto, fecha, mensaje, estado, actualizado)'
+                ' VALUES (?, ?, ?, ?, ?)'
+                ' ON CONFLICT (contacto, fecha) DO UPDATE'
+                ' SET estado = excluded.estado, actualizado = excluded.actualizado'
+                ' WHERE outbox.estado = ? OR (outbox.estado = ? AND outbox.actualizado < ?)',
+                (contact_key(person), date.isoformat(), message, SENDING, _now(),
+                 PENDING, SENDING, _lease_cutoff())
+            )
+            return cursor.rowcount > 0
+
+    def mark_sent(self, person, date):
+        self._execute(
+            'UPDATE outbox SET estado = ?, intentos = intentos + 1, error = NULL,'
+            ' actualizado = ? WHERE contacto = ? AND fecha = ?',
+            (SENT, _now(), contact_key(person), date.isoformat())
+        )
+
+    def mark_failed(self, person, date, error):
+        self._execute(
+            'UPDATE outbox SET estado = ?, intentos = intentos + 1, error = ?, actualizado = ?'
+            ' WHERE contacto = ? AND fecha = ?',
+            (PENDING, str(error), _now(), contact_key(person), date.isoformat())
+        )
+
+    def flush(self):
+        """Sin efecto: cada cambio ya se confirma en la base."""
+
+class StoreOutbox:
+    """Bandeja de salida guardada como JSON en un almacén de snapshot.py.
+
+    Útil en Cloud Functions con un bucket de Cloud Storage, donde un archivo
+    SQLite local no sobrevive entre instancias. Los cambios quedan en memoria
+    hasta flush(), que una sola vez por grupo de cambios relee el registro
+    del almacén, le aplica las entradas cambiadas aquí y lo sube, y descarta
+    las entradas con más de retention_days días.
+
+    Como el registro se sube por grupos, la reserva de claim() no depende
+    de él: cada envío reservado crea un objeto propio en el almacén con
+    store.create(), que falla si ya existe. El objeto se borra si el envío
+    falla, y mark_sent() lo reemplaza por una marca permanente de enviado
+    que claim() nunca vuelve a reservar.
+    """
+    def __init__(self, store, key='outbox', retention_days=30):
+        self.store = store
+        self.key = key
+        self.retention_days = retention_days
+        self._entries = None
+        self._changed = set()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def _load(self):
+        if self._entries is None:
+            data = self.store.read(self.key)
+            self._entries = json.loads(data.decode('utf-8')) if data else {}
+        return self._entries
+
+    def flush(self):
+        """Combina los cambios con el registro del almacén y lo sube.
+
+        Se relee el registro y solo se reemplazan las entradas cambiadas en
+        esta ejecución, así no se pisan las de otras; una entrada enviada
+        nunca vuelve a un estado anterior. La red se usa fuera del lock de
+        las entradas, así que los hilos de envío no esperan; _flush_lock
+        mantiene el orden de las subidas.
+        """
+        with self._flush_lock:
+            with self._lock:
+                if not self._changed:
+                    return
+                changes = {key: dict(self._entries[key]) for key in self._changed if key in self._entries}
+                self._changed = set()
+            try:
+                data = self.store.read(self.key)
+                stored = json.loads(data.decode('utf-8')) if data else {}
+                for key, entry in changes.items():
+                    current = stored.get(key)
+                    if current is None or current['estado'] != SENT or entry['estado'] == SENT:
+                        stored[key] = entry
+                cutoff = (datetime.date.today() - datetime.timedelta(days=self.retention_days)).isoformat()
+                expired = [key for key, entry in stored.items() if entry['fecha'] < cutoff]
+                for key in expired:
+                    del stored[key]
+                self.store.write(self.key, json.dumps(stored, ensure_ascii=False).encode('utf-8'))
+            except Exception:
+                with self._lock:
+                    self._changed.update(changes)
+                raise
+            with self._lock:
+                # Las entradas de otras ejecuciones pasan a la copia local,
+                # salvo las que cambiaron aquí mientras tanto
+                for key, entry in stored.items():
+                    if key not in self._changed:
+                        self._entries[key] = entry
+                for key in expired:
+                    self._entries.pop(key, None)
+            for key in expired:
+                self.store.delete(self._claim_key(key))
+
+    @staticmethod
+    def _key(person, date):
+        return f"{contact_key(person)}|{date.isoformat()}"
+
+    def _claim_key(self, key):
+        return f"{self.key}-envio-{hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]}"
+
+    def get(self, person, date):
+        with self._lock:
+            entry = self._load().get(self._key(person, date))
+            return {'estado': entry['estado'], 'mensaje': entry['mensaje']} if entry else None
+
+    def enqueue(self, person, date, message):
+        with self._lock:
+            entries = self._load()
+            key = self._key(person, date)
+            if key not in entries:
+                entries[key] = {
+                    'fecha': date.isoformat(), 'mensaje': message, 'estado': PENDING,
+                    'intentos': 0, 'error': None, 'actualizado': _now()
+                }
+                self._changed.add(key)
+
+    def claim(self, person, date, message):
+        """Reserva el envío; False si ya se envió o lo reservó otra ejecución.
+
+        Una reserva con más de CLAIM_LEASE_SECONDS se da por abandonada y se
+        reemplaza; la marca de enviado de mark_sent() no vence nunca.
+        """
+        key = self._key(person, date)
+        with self._lock:
+            entry = self._load().get(key)
+            if entry is not None and entry['estado'] == SENT:
+                return False
+        claim_key = self._claim_key(key)
+        stamp = _now().encode('utf-8')
+        if not self.store.create(claim_key, stamp):
+            previous = self.store.read(claim_key)
+            if previous == SENT_MARKER:
+                return False
+            if previous is not None and previous.decode('utf-8') >= _lease_cutoff():
+                return False
+            self.store.delete(claim_key)
+            if not self.store.create(claim_key, stamp):
+                return False
+        with self._lock:
+            entries = self._load()
+            entry = entries.setdefault(key, {
+                'fecha': date.isoformat(), 'mensaje': message, 'intentos': 0, 'error': None
+            })
+            entry.update(estado=SENDING, actualizado=_now())
+            self._changed.add(key)
+        return True
+
+    def _update(self, person, date, **changes):
+        key = self._key(person, date)
+        with self._lock:
+            entry = self._load().get(key)
+            if entry is None:
+                return
+            entry.update(changes, intentos=entry['intentos'] + 1, actualizado=_now())
+            self._changed.add(key)
+
+    def mark_sent(self, person, date):
+        """Marca el envío como hecho, también en su objeto de reserva.
+
+        La marca se escribe en el momento, sin esperar a flush(): aunque la
+        instancia muera antes de subir el registro, el correo no se reenvía.
+        """
+        self.store.write(self._claim_key(self._key(person, date)), SENT_MARKER)
+        self._update(person, date, estado=SENT, error=None)
+
+    def mark_failed(self, person, date, error):
+        self._update(person, date, estado=PENDING, error=str(error))
+        self.store.delete(self._claim_key(self._key(person, date)))
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
+
+def _lease_cutoff():
+    """Instante (como _now) antes del cual una reserva se da por abandonada."""
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=CLAIM_LEASE_SECONDS)
+    return cutoff.isoformat(timespec='seconds')
@@ -0,0 +1,136 @@
+import os
+import time
+import random
+import logging
+import threading
+import metrics
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# Valores por defecto por API: solicitudes por segundo, ráfaga máxima e
+# intentos ante 429/5xx, según las cuotas publicadas. Las cuotas de Gemini y
+# Sheets son por ventana de un minuto, así que la ráfaga es lo que admite un
+# minuto completo y la tasa solo frena cuando se agota. Se cambian con variables
+# de entorno RATE_LIMIT_<API>, RATE_BURST_<API> y RETRY_ATTEMPTS_<API>; un
+# RATE_LIMIT_<API> de 0 desactiva el límite.
+DEFAULTS = {
+    # Gemini 2.5 Flash admite 10 solicitudes por minuto en el nivel gratuito
+    # (1000 por minuto en el nivel pago 1, es decir RATE_LIMIT_GEMINI=16)
+    'gemini': {'rate': 10 / 60, 'burst': 10, 'attempts': 4},
+    # Gmail permite 250 unidades de cuota por segundo y usuario; enviar cuesta 100
+    'gmail': {'rate': 2.5, 'burst': 5, 'attempts': 4},
+    # Sheets admite 60 lecturas por minuto por usuario (la cuenta de servicio)
+    'sheets': {'rate': 60 / 60, 'burst': 60, 'attempts': 3},
+}
+
+class DeadlineExceeded(Exception):
+    """No queda tiempo antes del plazo para esperar la cuota o reintentar."""
+
+class TokenBucket:
+    """Limita la tasa de llamadas; seguro entre hilos."""
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1, deadline=None):
+        """Espera hasta poder consumir tokens (sin espera si rate es 0).
+
+        Si se piden más tokens que la ráfaga máxima (un lote de correos, por
+        ejemplo) se consumen por partes, así que la tasa media se respeta.
+        Con deadline (time.monotonic()) lanza DeadlineExceeded en vez de
+        esperar más allá del plazo.
+        """
+        if self.rate <= 0:
+            return
+        while tokens > 0:
+            take = min(tokens, self.capacity)
+            self._take(take, deadline)
+            tokens -= take
+
+    def _take(self, tokens, deadline=None):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            if deadline is not None and time.monotonic() + wait >= deadline:
+                raise DeadlineExceeded(f"sin tiempo para esperar {wait:.1f}s de cuota")
+            time.sleep(wait)
+
+def error_status(error):
+    """Código HTTP de un error de googleapiclient o google.api_core, si lo tiene."""
+    resp = getattr(error, 'resp', None)
+    if resp is not None and getattr(resp, 'status', None) is not None:
+        return int(resp.status)
+    code = getattr(error, 'code', None)
+    return code if isinstance(code, int) else None
+
+def is_retryable(error):
+    return error_status(error) in RETRYABLE_STATUS
+
+class ApiLimiter:
+    """Token bucket y reintentos con backoff exponencial y jitter para una API."""
+    def __init__(self, name, rate, burst, attempts, base_delay=1.0, max_delay=32.0):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.attempts = max(1, attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt, deadline=None):
+        """Espera antes del reintento attempt (1, 2, ...) con jitter completo.
+
+        Devuelve False sin esperar si la espera terminaría después de
+        deadline (time.monotonic()): ya no hay tiempo para reintentar.
+        """
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            return False
+        metrics.incr(f"reintentos_{self.name}")
+        time.sleep(delay)
+        return True
+
+    def call(self, function, tokens=1, deadline=None):
+        """Ejecuta function respetando la tasa; reintenta ante 429 y 5xx.
+
+        Con deadline no se espera cuota ni se reintenta más allá del plazo:
+        se lanza DeadlineExceeded.
+        """
+        for attempt in range(1, self.attempts + 1):
+            self.bucket.acquire(tokens, deadline)
+            try:
+                return function()
+            except Exception as error:
+                if attempt == self.attempts or not is_retryable(error):
+                    raise
+                logging.info(
+                    f"{self.name} respondió {error_status(error)}, "
+                    f"reintento {attempt} de {self.attempts - 1}"
+                )
+                if not self.backoff(attempt, deadline):
+                    raise DeadlineExceeded(f"sin tiempo para reintentar {self.name}") from error
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_limiter(name):
+    """Limitador compartido por todos los hilos para la API name."""
+    with _limiters_lock:
+        limiter = _limiters.get(name)
+        if limiter is None:
+            defaults = DEFAULTS.get(name, {'rate': 0.0, 'burst': 1, 'attempts': 3})
+            key = name.upper()
+            limiter = _limiters[name] = ApiLimiter(
+                name,
+                float(os.getenv(f'RATE_LIMIT_{key}', defaults['rate'])),
+                int(os.getenv(f'RATE_BURST_{key}', defaults['burst'])),
+                int(os.getenv(f'RETRY_ATTEMPTS_{key}', defaults['attempts'])),
+            )
+        return limiter
@@ -0,0 +1,184 @@
+import os
+import re
+import gzip
+import json
+import logging
+import tempfile
+import metrics
+import ratelimit
+from ratelimit import error_status
+from utils import (
+    BirthdayIndex, Contact, SheetHeader, iter_sheet_records, out_of_time, read_sheet_columns,
+    timed_import, work_deadline
+)
+
+# 2: las fechas con tipo fecha del año en curso ya no se guardan como MM/DD
+SNAPSHOT_VERSION = 2
+
+class LocalSnapshotStore:
+    """Guarda las instantáneas como archivos en un directorio local."""
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json.gz")
+
+    def read(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def write(self, key, data):
+        os.makedirs(self.directory, exist_ok=True)
+        # Un temporal propio por escritura: dos ejecuciones pueden escribir a la vez
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix='.tmp', delete=False) as f:
+            f.write(data)
+        os.replace(f.name, self._path(key))
+
+    def create(self, key, data):
+        """Escribe key solo si no existe; devuelve False si ya existía.
+
+        El enlace duro del temporal aparece ya con su contenido y falla si
+        el archivo existe, así que nadie lee un archivo a medio escribir.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix='.tmp') as f:
+            f.write(data)
+            f.flush()
+            try:
+                os.link(f.name, self._path(key))
+            except FileExistsError:
+                return False
+        return True
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+class GCSSnapshotStore:
+    """Guarda las instantáneas en un bucket de Cloud Storage.
+
+    Requiere google-cloud-storage, que solo se importa si se usa este almacén.
+    """
+    def __init__(self, bucket_name, prefix='snapshots/'):
+        storage = timed_import('google.cloud.storage')
+        self.bucket = storage.Client().bucket(bucket_name)
+        self.prefix = prefix
+
+    def read(self, key):
+        blob = self.bucket.blob(f"{self.prefix}{key}.json.gz")
+        if not blob.exists():
+            return None
+        return blob.download_as_bytes()
+
+    def write(self, key, data):
+        self.bucket.blob(f"{self.prefix}{key}.json.gz").upload_from_string(data)
+
+    def create(self, key, data):
+        """Escribe key solo si no existe; devuelve False si ya existía.
+
+        if_generation_match=0 hace que Cloud Storage rechace la subida con
+        412 si el objeto ya existe, así que la comprobación es atómica.
+        """
+        try:
+            self.bucket.blob(f"{self.prefix}{key}.json.gz").upload_from_string(
+                data, if_generation_match=0
+            )
+        except Exception as error:
+            if error_status(error) == 412:
+                return False
+            raise
+        return True
+
+    def delete(self, key):
+        blob = self.bucket.blob(f"{self.prefix}{key}.json.gz")
+        if blob.exists():
+            blob.delete()
+
+def get_sheet_revision(drive_service, spreadsheet_id, deadline=None):
+    """Consulta a Drive la versión de la hoja; cambia con cada edición."""
+    def fetch():
+        with metrics.span('drive.revision'):
+            return drive_service.files().get(
+                fileId=spreadsheet_id, fields='version,modifiedTime'
+            ).execute()
+    metadata = ratelimit.get_limiter('drive').call(fetch, deadline=deadline)
+    return f"{metadata.get('version')}@{metadata.get('modifiedTime')}"
+
+def snapshot_key(config):
+    """Nombre de archivo seguro para la hoja y el rango configurados."""
+    return re.sub(r'[^A-Za-z0-9_-]', '_', f"{config.spreadsheet_id}-{config.range_name}")
+
+def dump_snapshot(revision, index):
+    """Serializa los contactos y el índice derivado en JSON comprimido."""
+    header = index.records[0].header.names if index.records else ()
+    state = {
+        'version': SNAPSHOT_VERSION,
+        'revision': revision,
+        'header': list(header),
+        'rows': [list(record.values) for record in index.records],
+        'buckets': [[month, day, list(map(int, positions))]
+                    for (month, day), positions in index.buckets.items()],
+        'years': list(map(int, index.years)),
+        'invalid': list(index.invalid),
+        'zones': list(index.zones),
+    }
+    return gzip.compress(json.dumps(state, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+def load_snapshot(data):
+    """Reconstruye (revisión, BirthdayIndex) desde una instantánea."""
+    state = json.loads(gzip.decompress(data).decode('utf-8'))
+    if state.get('version') != SNAPSHOT_VERSION:
+        return None, None
+    header = SheetHeader(state['header'])
+    records = [Contact(header, row) for row in state['rows']]
+    buckets = {(month, day): positions for month, day, positions in state['buckets']}
+    index = BirthdayIndex.from_state(
+        records, buckets, state['years'], state['invalid'], state.get('zones', ())
+    )
+    return state['revision'], index
+
+class SnapshotIndexLoader:
+    """Carga el índice de cumpleaños desde una instantánea si la hoja no cambió.
+
+    Se usa como config.index_loader: primero pide a Drive la revisión de la
+    hoja (una llamada barata) y solo descarga y reindexa la hoja cuando la
+    revisión difiere de la guardada. Con config.deadline ningún paso empieza
+    pasado work_deadline: se lanza ratelimit.DeadlineExceeded.
+    """
+    def __init__(self, store, drive_service):
+        self.store = store
+        self.drive_service = drive_service
+
+    def __call__(self, sheets_service, config):
+        key = snapshot_key(config)
+        revision = get_sheet_revision(self.drive_service, config.spreadsheet_id, work_deadline(config))
+
+        if out_of_time(config):
+            raise ratelimit.DeadlineExceeded("plazo de la ejecución al leer la instantánea")
+        data = self.store.read(key)
+        if data is not None:
+            try:
+                cached_revision, index = load_snapshot(data)
+            except (OSError, ValueError, KeyError):
+                logging.exception("Instantánea de contactos corrupta, se descarta")
+                cached_revision, index = None, None
+            if cached_revision == revision:
+                logging.info(f"Hoja sin cambios (revisión {revision}), usando instantánea")
+                metrics.incr('instantanea_reutilizada')
+                return index
+
+        logging.info(f"Hoja modificada (revisión {revision}), descargando de nuevo")
+        if config.sheet_reader == 'columns':
+            index = read_sheet_columns(sheets_service, config)
+        else:
+            index = BirthdayIndex(iter_sheet_records(sheets_service, config))
+        if out_of_time(config):
+            # Sin tiempo para guardarla; la próxima ejecución la vuelve a armar
+            return index
+        self.store.write(key, dump_snapshot(revision, index))
+        return index
@@ -0,0 +1,74 @@
+import os
+import sys
+import datetime
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import BirthdayIndex, Contact, SheetHeader
+
+HEADER = SheetHeader(['nombre', 'correo electrónico', 'fecha de nacimiento'])
+
+def make_index(birthdays):
+    """Índice sobre contactos {nombre: fecha de nacimiento}."""
+    return BirthdayIndex([
+        Contact(HEADER, [nombre, f"{nombre.lower()}@example.com", fecha])
+        for nombre, fecha in birthdays.items()
+    ])
+
+def names_by_date(found):
+    return [(date, row['nombre']) for date, row in found]
+
+class BirthdaysBetweenTest(unittest.TestCase):
+    def test_range_crosses_new_year(self):
+        index = make_index({'Ana': '1990/12/31', 'Luis': '01/01', 'Eva': '06/15', 'Juan': '12/29'})
+
+        found = index.birthdays_between(datetime.date(2025, 12, 30), datetime.date(2026, 1, 2))
+
+        self.assertEqual(names_by_date(found), [
+            (datetime.date(2025, 12, 31), 'Ana'),
+            (datetime.date(2026, 1, 1), 'Luis'),
+        ])
+        self.assertEqual(found[0][1]['edad'], 35)
+
+    def test_range_over_several_years_repeats_each_birthday(self):
+        index = make_index({'Ana': '03/10'})
+
+        found = index.birthdays_between(datetime.date(2025, 1, 1), datetime.date(2027, 12, 31))
+
+        self.assertEqual([date.year for date, _ in found], [2025, 2026, 2027])
+
+    def test_feb_29_is_celebrated_on_feb_28_in_common_years(self):
+        index = make_index({'Ana': '2000/02/29', 'Luis': '02/28', 'Eva': '03/01'})
+
+        found = index.birthdays_between(datetime.date(2027, 2, 27), datetime.date(2027, 3, 1))
+
+        self.assertEqual(names_by_date(found), [
+            (datetime.date(2027, 2, 28), 'Luis'),
+            (datetime.date(2027, 2, 28), 'Ana'),
+            (datetime.date(2027, 3, 1), 'Eva'),
+        ])
+
+    def test_feb_29_in_leap_years(self):
+        index = make_index({'Ana': '2000/02/29', 'Luis': '02/28'})
+
+        found = index.birthdays_between(datetime.date(2028, 2, 28), datetime.date(2028, 2, 29))
+
+        self.assertEqual(names_by_date(found), [
+            (datetime.date(2028, 2, 28), 'Luis'),
+            (datetime.date(2028, 2, 29), 'Ana'),
+        ])
+
+    def test_range_ending_on_feb_28_includes_feb_29(self):
+        index = make_index({'Ana': '02/29'})
+
+        self.assertEqual(
+            names_by_date(index.birthdays_between(datetime.date(2027, 2, 28), datetime.date(2027, 2, 28))),
+            [(datetime.date(2027, 2, 28), 'Ana')]
+        )
+        self.assertEqual(
+            index.birthdays_between(datetime.date(2027, 3, 1), datetime.date(2027, 3, 31)), []
+        )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+import os
+import sys
+import datetime
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('RATE_LIMIT_GMAIL', '0')
+
+import outbox
+from outbox import SQLiteOutbox, StoreOutbox
+from snapshot import LocalSnapshotStore
+from utils import Config, run_birthday_pipeline
+
+ANA = {'nombre': 'Ana', 'correo electrónico': 'ana@example.com'}
+LUIS = {'nombre': 'Luis', 'correo electrónico': 'luis@example.com'}
+
+class FakeGmailService:
+    """Imita users().messages().send() y guarda los destinatarios enviados."""
+    def __init__(self):
+        self.sent = []
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def send(self, userId, body):
+        return _SendRequest(self, body)
+
+class _SendRequest:
+    def __init__(self, service, body):
+        self.service = service
+        self.body = body
+
+    def execute(self, http=None):
+        self.service.sent.append(self.body)
+
+class FakeMessageCache:
+    """Caché de mensajes pregenerados: evita llamar a Gemini en las pruebas."""
+    def peek(self, person, date):
+        return f"¡Feliz cumpleaños, {person['nombre']}!"
+
+    def discard(self, person, date):
+        pass
+
+    def save(self):
+        pass
+
+def expire_claims(test):
+    """Hace que toda reserva cuente como abandonada durante la prueba."""
+    lease = outbox.CLAIM_LEASE_SECONDS
+    outbox.CLAIM_LEASE_SECONDS = -3600
+    test.addCleanup(setattr, outbox, 'CLAIM_LEASE_SECONDS', lease)
+
+class StoreOutboxTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = LocalSnapshotStore(directory.name)
+        self.today = datetime.date.today()
+
+    def test_claim_is_exclusive_between_runs(self):
+        first, second = StoreOutbox(self.store), StoreOutbox(self.store)
+
+        self.assertTrue(first.claim(ANA, self.today, 'hola'))
+        self.assertFalse(second.claim(ANA, self.today, 'hola'))
+
+    def test_failed_send_can_be_claimed_again(self):
+        first, second = StoreOutbox(self.store), StoreOutbox(self.store)
+        first.claim(ANA, self.today, 'hola')
+
+        first.mark_failed(ANA, self.today, 'error 500')
+
+        self.assertTrue(second.claim(ANA, self.today, 'hola'))
+
+    def test_abandoned_claim_is_reclaimed_after_lease(self):
+        StoreOutbox(self.store).claim(ANA, self.today, 'hola')
+        expire_claims(self)
+
+        self.assertTrue(StoreOutbox(self.store).claim(ANA, self.today, 'hola'))
+
+    def test_sent_mail_is_not_reclaimed_after_crash_before_flush(self):
+        first = StoreOutbox(self.store)
+        first.claim(ANA, self.today, 'hola')
+        first.mark_sent(ANA, self.today)
+        expire_claims(self)
+
+        self.assertFalse(StoreOutbox(self.store).claim(ANA, self.today, 'hola'))
+
+    def test_stale_flush_does_not_downgrade_sent_entry(self):
+        sender, stale = StoreOutbox(self.store), StoreOutbox(self.store)
+        stale.get(LUIS, self.today)  # carga el registro antes del envío
+        sender.enqueue(ANA, self.today, 'hola')
+        sender.claim(ANA, self.today, 'hola')
+        sender.mark_sent(ANA, self.today)
+        sender.flush()
+
+        stale.enqueue(ANA, self.today, 'hola')
+        stale.flush()
+        expire_claims(self)
+        later = StoreOutbox(self.store)
+
+        self.assertEqual(later.get(ANA, self.today)['estado'], outbox.SENT)
+        self.assertFalse(later.claim(ANA, self.today, 'hola'))
+
+    def test_flush_keeps_entries_of_other_runs(self):
+        first, second = StoreOutbox(self.store), StoreOutbox(self.store)
+        first.get(ANA, self.today)
+        second.get(ANA, self.today)
+        first.enqueue(ANA, self.today, 'hola Ana')
+        second.enqueue(LUIS, self.today, 'hola Luis')
+
+        first.flush()
+        second.flush()
+        merged = StoreOutbox(self.store)
+
+        self.assertEqual(merged.get(ANA, self.today)['mensaje'], 'hola Ana')
+        self.assertEqual(merged.get(LUIS, self.today)['mensaje'], 'hola Luis')
+
+class PipelineRerunTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.today = datetime.date.today()
+
+    def run_pipeline(self, ledger, gmail):
+        config = Config()
+        config.generate_workers = 1
+        config.send_workers = 1
+        config.send_mode = 'individual'
+        config.message_cache = FakeMessageCache()
+        config.outbox = ledger
+        return run_birthday_pipeline([ANA, LUIS], gmail, config, 'bot@example.com', self.today)
+
+    def test_rerun_skips_mails_already_sent(self):
+        factories = {
+            'sqlite': lambda: SQLiteOutbox(os.path.join(self.directory, 'outbox.db')),
+            'store': lambda: StoreOutbox(LocalSnapshotStore(self.directory)),
+        }
+        for name, factory in factories.items():
+            with self.subTest(outbox=name):
+                gmail = FakeGmailService()
+
+                first = self.run_pipeline(factory(), gmail)
+                second = self.run_pipeline(factory(), gmail)
+
+                self.assertEqual(sorted(first['enviados']), ['Ana', 'Luis'])
+                self.assertEqual(second['enviados'], [])
+                self.assertEqual(sorted(second['omitidos']), ['Ana', 'Luis'])
+                self.assertEqual(len(gmail.sent), 2)
+
+if __name__ == '__main__':
+    unittest.main()
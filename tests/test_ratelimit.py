@@ -0,0 +1,150 @@
+import os
+import sys
+import time
+import types
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('RATE_LIMIT_GMAIL', '0')
+
+import ratelimit
+from ratelimit import DeadlineExceeded, TokenBucket
+from utils import send_birthday_emails_batch
+
+class FakeHttpError(Exception):
+    """Error con el código HTTP en resp.status, como los de googleapiclient."""
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.resp = types.SimpleNamespace(status=status)
+
+class BatchGmailService:
+    """Imita las peticiones batch de Gmail.
+
+    failures es {posición del correo: [código HTTP de cada intento]}; un
+    correo sin códigos pendientes se envía bien. batches guarda las
+    posiciones de cada lote ejecutado.
+    """
+    def __init__(self, failures=None):
+        self.failures = {position: list(codes) for position, codes in (failures or {}).items()}
+        self.batches = []
+
+    def new_batch_http_request(self, callback):
+        return _Batch(self, callback)
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def send(self, userId, body):
+        return body
+
+class _Batch:
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.request_ids = []
+
+    def add(self, request, request_id):
+        self.request_ids.append(request_id)
+
+    def execute(self):
+        self.service.batches.append([int(request_id) for request_id in self.request_ids])
+        for request_id in self.request_ids:
+            codes = self.service.failures.get(int(request_id))
+            error = FakeHttpError(codes.pop(0)) if codes else None
+            self.callback(request_id, None if error else {}, error)
+
+def make_emails(count):
+    return [(f"p{i}@example.com", 'Asunto', f"Mensaje {i}") for i in range(count)]
+
+class TokenBucketTest(unittest.TestCase):
+    def test_burst_is_available_at_once(self):
+        bucket = TokenBucket(rate=1, burst=10)
+
+        started = time.monotonic()
+        bucket.acquire(10)
+
+        self.assertLess(time.monotonic() - started, 0.5)
+
+    def test_waits_for_tokens_after_burst(self):
+        bucket = TokenBucket(rate=50, burst=2)
+        bucket.acquire(2)
+
+        started = time.monotonic()
+        bucket.acquire(1)
+
+        self.assertGreaterEqual(time.monotonic() - started, 0.015)
+
+    def test_request_larger_than_burst_is_taken_in_parts(self):
+        bucket = TokenBucket(rate=100, burst=2)
+
+        started = time.monotonic()
+        bucket.acquire(6)
+
+        self.assertGreaterEqual(time.monotonic() - started, 0.035)
+
+    def test_deadline_raises_instead_of_waiting(self):
+        bucket = TokenBucket(rate=0.1, burst=1)
+        bucket.acquire(1)
+
+        started = time.monotonic()
+        with self.assertRaises(DeadlineExceeded):
+            bucket.acquire(1, deadline=time.monotonic() + 1)
+
+        self.assertLess(time.monotonic() - started, 0.5)
+
+    def test_zero_rate_never_waits(self):
+        bucket = TokenBucket(rate=0, burst=1)
+
+        started = time.monotonic()
+        bucket.acquire(1000)
+
+        self.assertLess(time.monotonic() - started, 0.5)
+
+class SendBatchRetryTest(unittest.TestCase):
+    def setUp(self):
+        limiter = ratelimit.get_limiter('gmail')
+        self.addCleanup(setattr, limiter, 'base_delay', limiter.base_delay)
+        limiter.base_delay = 0.0
+        self.attempts = limiter.attempts
+
+    def test_only_temporary_failures_are_retried(self):
+        service = BatchGmailService({1: [429], 2: [400], 3: [503, 500]})
+
+        errors = send_birthday_emails_batch(service, make_emails(5), 'bot@example.com')
+
+        self.assertEqual(service.batches, [[0, 1, 2, 3, 4], [1, 3], [3]])
+        self.assertEqual([error is None for error in errors], [True, True, False, True, True])
+        self.assertEqual(errors[2].resp.status, 400)
+
+    def test_persistent_failure_stops_after_last_attempt(self):
+        service = BatchGmailService({0: [429] * 10})
+
+        errors = send_birthday_emails_batch(service, make_emails(2), 'bot@example.com')
+
+        self.assertEqual(service.batches, [[0, 1]] + [[0]] * (self.attempts - 1))
+        self.assertEqual(errors[0].resp.status, 429)
+        self.assertIsNone(errors[1])
+
+    def test_emails_are_split_into_batches_of_batch_size(self):
+        service = BatchGmailService({4: [500]})
+
+        errors = send_birthday_emails_batch(service, make_emails(5), 'bot@example.com', batch_size=2)
+
+        self.assertEqual(service.batches, [[0, 1], [2, 3], [4], [4]])
+        self.assertEqual(errors, [None] * 5)
+
+    def test_past_deadline_leaves_emails_unsent(self):
+        service = BatchGmailService()
+
+        errors = send_birthday_emails_batch(
+            service, make_emails(3), 'bot@example.com', deadline=time.monotonic() - 1
+        )
+
+        self.assertEqual(service.batches, [])
+        self.assertTrue(all(isinstance(error, DeadlineExceeded) for error in errors))
+
+if __name__ == '__main__':
+    unittest.main()
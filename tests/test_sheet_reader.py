@@ -0,0 +1,87 @@
+import os
+import re
+import datetime
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('RATE_LIMIT_SHEETS', '0')
+
+from utils import SERIAL_EPOCH, Config, _decode_birth_dates, iter_sheet_records
+
+HEADER = ['nombre', 'correo electrónico', 'fecha de nacimiento']
+
+class GapSheetsService:
+    """Imita la API de Sheets sobre filas fijas, donde [] es una fila en blanco.
+
+    Como la API real, values().get() omite las filas vacías al final del rango
+    pedido y spreadsheets().get() informa el tamaño de la cuadrícula.
+    """
+    def __init__(self, rows, grid_rows=1000):
+        self.rows = [HEADER] + rows
+        self.grid_rows = grid_rows
+        self.calls = []
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def get(self, spreadsheetId, range=None, ranges=None, fields=None):
+        if range is None:
+            self.calls.append('metadata')
+            return _Request({'sheets': [{'properties': {'gridProperties': {'rowCount': self.grid_rows}}}]})
+        first, last = map(int, re.findall(r'[A-Z]+(\d+)', range))
+        self.calls.append((first, last))
+        values = self.rows[first - 1:last]
+        while values and not values[-1]:
+            values.pop()
+        return _Request({'values': values} if values else {})
+
+class _Request:
+    def __init__(self, result):
+        self.result = result
+
+    def execute(self):
+        return self.result
+
+def contact_rows(count, offset=0):
+    return [[f"Persona {offset + i}", f"p{offset + i}@example.com", '01/02'] for i in range(count)]
+
+def make_config(page_size):
+    config = Config()
+    config.spreadsheet_id = 'hoja'
+    config.range_name = 'Contactos!A:C'
+    config.sheet_page_size = page_size
+    return config
+
+class IterSheetRecordsTest(unittest.TestCase):
+    def test_reads_contacts_after_blank_row_gap(self):
+        rows = contact_rows(8) + [[], []] + contact_rows(5, offset=8)
+        service = GapSheetsService(rows, grid_rows=20)
+
+        names = [c.get('nombre') for c in iter_sheet_records(service, make_config(5))]
+
+        self.assertEqual(names, [f"Persona {i}" for i in range(13)])
+
+    def test_stops_at_grid_row_count(self):
+        service = GapSheetsService(contact_rows(3), grid_rows=11)
+
+        contacts = list(iter_sheet_records(service, make_config(5)))
+
+        self.assertEqual(len(contacts), 3)
+        self.assertEqual(service.calls, [(1, 1), 'metadata', (2, 6), (7, 11)])
+
+class DecodeBirthDatesTest(unittest.TestCase):
+    def test_typed_dates_keep_their_year(self):
+        today = datetime.date.today()
+        serial = (today - SERIAL_EPOCH).days
+
+        dates, normalized = _decode_birth_dates([serial, '03/15'])
+
+        self.assertEqual(dates, [(today.year, today.month, today.day), (0, 3, 15)])
+        self.assertEqual(normalized, [today.strftime('%Y/%m/%d'), '03/15'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,17 +1,129 @@
 import os
 import datetime
+import calendar
 import base64
 import logging
-import pandas as pd
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import re
+import sys
+import bisect
+import json
+import time
+import importlib
+import importlib.util
 from email.mime.text import MIMEText
 from base64 import urlsafe_b64encode
-import google.generativeai as genai
+import metrics
+import ratelimit
+
+# Dependencias pesadas: se importan bajo demanda (ver timed_import) para que
+# el arranque en frío no pague pandas ni Gemini si no se usan.
+np = pd = genai = None
+HAS_PANDAS = importlib.util.find_spec('pandas') is not None
+
+IMPORT_TIMES = {}
+
+def timed_import(name):
+    """Importa un módulo y registra cuánto tardó la primera importación."""
+    if name in sys.modules:
+        return sys.modules[name]
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    IMPORT_TIMES[name] = time.perf_counter() - start
+    return module
+
+def _import_pandas():
+    """Importa pandas y numpy la primera vez que se necesitan."""
+    global np, pd
+    if pd is None:
+        if not HAS_PANDAS:
+            raise ImportError("Esta operación requiere pandas; usa iter_sheet_records")
+        np = timed_import('numpy')
+        pd = timed_import('pandas')
+    return pd
+
+def _import_genai():
+    """Importa google.generativeai la primera vez que se necesita."""
+    global genai
+    if genai is None:
+        genai = timed_import('google.generativeai')
+    return genai
+
+GEMINI_MODEL = 'gemini-2.5-flash-preview-05-20'
+_gemini_models = {}
+
+def get_gemini_model(name=GEMINI_MODEL):
+    """Devuelve el modelo de Gemini, reutilizado entre mensajes e invocaciones."""
+    model = _gemini_models.get(name)
+    if model is None:
+        model = _gemini_models[name] = _import_genai().GenerativeModel(name)
+    return model
+
+class Lazy:
+    """Valor costoso de construir que se crea la primera vez que se pide."""
+    def __init__(self, factory):
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._done = False
+        self._value = None
+
+    def get(self):
+        with self._lock:
+            if not self._done:
+                self._value = self._factory()
+                self._done = True
+        return self._value
+
+def resolve(value):
+    """Devuelve el valor de un Lazy, o el valor tal cual si no lo es."""
+    return value.get() if isinstance(value, Lazy) else value
 
 class Config:
     """Clase para mantener la configuración de la aplicación."""
     def __init__(self):
         self.spreadsheet_id = None
         self.range_name = None
+        self.generate_workers = int(os.getenv('GENERATE_WORKERS', '4'))
+        self.send_workers = int(os.getenv('SEND_WORKERS', '2'))
+        self.send_mode = os.getenv('SEND_MODE', 'individual')
+        self.email_batch_size = int(os.getenv('EMAIL_BATCH_SIZE', '50'))
+        self.sheet_reader = os.getenv('SHEET_READER', 'pandas' if HAS_PANDAS else 'stream')
+        self.gemini_setup = None  # Lazy opcional que configura Gemini antes de generar
+        self.sheet_page_size = int(os.getenv('SHEET_PAGE_SIZE', '1000'))
+        self.index_loader = None  # callable(sheets_service, config) -> BirthdayIndex
+        self.message_cache = None  # MessageCache opcional con mensajes pregenerados
+        self.lookahead_days = int(os.getenv('LOOKAHEAD_DAYS', '7'))
+        self.gemini_batch_size = int(os.getenv('GEMINI_BATCH_SIZE', '1'))
+        self.outbox = None  # registro de envíos opcional (ver outbox.py)
+        self.timezone = os.getenv('TIMEZONE')  # zona IANA para decidir qué día es hoy
+        self.send_hour = None  # hora local de envío en el modo por hora (ver process_hourly_birthdays)
+        self.deadline = None  # time.monotonic() en que vence el tiempo de la ejecución
+        # Segundos antes de deadline en que se deja de generar y enviar, reservados
+        # para guardar el registro y el punto de control
+        self.deadline_margin = float(os.getenv('DEADLINE_MARGIN_SECONDS', '5'))
+
+def time_left(config):
+    """Segundos que quedan hasta config.deadline, o None si no hay límite."""
+    if config.deadline is None:
+        return None
+    return config.deadline - time.monotonic()
+
+def work_deadline(config):
+    """Instante (time.monotonic()) desde el que no se empieza a generar ni a enviar.
+
+    Es config.deadline menos config.deadline_margin; None si no hay límite.
+    Se pasa a los limitadores para que esperas y reintentos no lo superen.
+    """
+    if config.deadline is None:
+        return None
+    return config.deadline - config.deadline_margin
+
+def out_of_time(config):
+    """True si lo que queda de plazo ya no alcanza para empezar trabajo nuevo."""
+    remaining = time_left(config)
+    return remaining is not None and remaining <= config.deadline_margin
 
 def setup_logging():
     """Configura el sistema de logging."""
@@ -28,117 +140,1206 @@ def setup_logging():
         handlers=handlers
     )
 
-def get_today_birthdays(df):
+def parse_birth_date(value):
+    """Parsea una fecha YYYY/MM/DD o MM/DD. Devuelve (año, mes, día) o None.
+
+    El año es 0 cuando la fecha viene en formato MM/DD.
+    """
+    parts = str(value).strip().split('/')
+    try:
+        numbers = [int(part) for part in parts]
+    except ValueError:
+        return None
+    if len(numbers) == 3:
+        year, month, day = numbers
+    elif len(numbers) == 2:
+        year, (month, day) = 0, numbers
+    else:
+        return None
+    if not (1 <= month <= 12 and 1 <= day <= 31):
+        return None
+    return year, month, day
+
+def parse_birth_dates(dates):
+    """Parsea en bloque una columna de fechas (YYYY/MM/DD o MM/DD).
+
+    Devuelve arreglos (años, meses, días, válidos); el año es 0 cuando la
+    fecha viene en formato MM/DD.
+    """
+    _import_pandas()
+    dates = pd.Series(dates, dtype=object).astype(str).str.strip()
+    parts = dates.str.split('/', expand=True)
+    n_parts = dates.str.count('/') + 1
+    while parts.shape[1] < 3:
+        parts[parts.shape[1]] = None
+    numbers = parts.iloc[:, :3].apply(pd.to_numeric, errors='coerce')
+
+    full = (n_parts == 3).to_numpy()
+    short = (n_parts == 2).to_numpy()
+    first, second, third = (numbers[c].to_numpy() for c in numbers.columns[:3])
+    years = np.where(full, first, 0)
+    months = np.where(full, second, first)
+    days = np.where(full, third, second)
+
+    valid = (full | short) & ~np.isnan(months) & ~np.isnan(days) & ~np.isnan(years)
+    valid &= (months >= 1) & (months <= 12) & (days >= 1) & (days <= 31)
+    years = np.nan_to_num(years).astype(int)
+    months = np.nan_to_num(months).astype(int)
+    days = np.nan_to_num(days).astype(int)
+    return years, months, days, valid
+
+def _log_invalid_dates(values):
+    """Registra en una sola línea las fechas no válidas encontradas."""
+    metrics.incr('fechas_invalidas', len(values))
+    if values:
+        logging.info(f"Formato de fecha no válido en {len(values)} filas: {values[:10]}")
+
+_LEAP_MONTH_DAYS = [31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+_LEAP_ORDINAL_DATES = {}  # día del año bisiesto -> (mes, día)
+for _month, _days in enumerate(_LEAP_MONTH_DAYS, start=1):
+    for _day in range(1, _days + 1):
+        _LEAP_ORDINAL_DATES[len(_LEAP_ORDINAL_DATES) + 1] = (_month, _day)
+_LEAP_ORDINALS = {date: ordinal for ordinal, date in _LEAP_ORDINAL_DATES.items()}
+
+def _leap_ordinal(month, day):
+    """Día del año de (mes, día) en un año bisiesto, de 1 a 366."""
+    return _LEAP_ORDINALS[(month, day)]
+
+def _is_feb_28_of_common_year(date):
+    return date.month == 2 and date.day == 28 and not calendar.isleap(date.year)
+
+class SheetHeader:
+    """Encabezados de la hoja, compartidos por todos los registros."""
+    __slots__ = ('names', 'positions')
+
+    def __init__(self, names):
+        self.names = tuple(h.strip().lower() for h in names)
+        self.positions = {name: i for i, name in enumerate(self.names)}
+
+class Contact:
+    """Fila de la hoja de contactos respaldada por una tupla.
+
+    Ocupa mucha menos memoria que un dict por fila; expone get() y to_dict()
+    para que el resto del código lo use igual que una fila de DataFrame.
+    """
+    __slots__ = ('header', 'values')
+
+    def __init__(self, header, values):
+        self.header = header
+        self.values = tuple(values)
+
+    def get(self, key, default=None):
+        position = self.header.positions.get(key)
+        if position is None or position >= len(self.values):
+            return default
+        return self.values[position]
+
+    def to_dict(self):
+        values = self.values + (None,) * (len(self.header.names) - len(self.values))
+        return dict(zip(self.header.names, values))
+
+TIMEZONE_COLUMN = 'zona horaria'
+# Zona de las filas sin zona en el modo por hora cuando no hay TIMEZONE: la
+# misma del scheduler diario, para no enviarles a las 8:00 UTC
+HOURLY_DEFAULT_TIMEZONE = 'America/Bogota'
+
+class BirthdayIndex:
+    """Índice (mes, día) -> posiciones de fila de la hoja de contactos.
+
+    Acepta un DataFrame, que se parsea en una sola pasada vectorizada, o un
+    iterable de Contact, que se indexa a medida que llega. Cada consulta
+    diaria es una búsqueda en un diccionario más el trabajo de las filas
+    encontradas. zones guarda la zona horaria de cada fila ('' si no tiene).
+    Con dates, una lista alineada con los registros de (año, mes, día) o
+    None, las fechas ya decodificadas no se vuelven a parsear.
+    """
+    def __init__(self, source, dates=None):
+        self.buckets = {}
+        self.years = []
+        self.invalid = []
+        self.zones = []
+        pandas = sys.modules.get('pandas')
+        if pandas is not None and isinstance(source, pandas.DataFrame):
+            _import_pandas()
+            self._index_dataframe(source)
+        else:
+            self._index_records(source, dates)
+
+    def _index_dataframe(self, df):
+        self._fetch = lambda positions: df.iloc[positions].to_dict('records')
+        self.years = np.zeros(len(df), dtype=int)
+        if TIMEZONE_COLUMN in df.columns:
+            self.zones = df[TIMEZONE_COLUMN].fillna('').astype(str).str.strip().tolist()
+        if 'fecha de nacimiento' not in df.columns or df.empty:
+            return
+
+        column = df['fecha de nacimiento']
+        years, months, days, valid = parse_birth_dates(column.to_numpy())
+        self.years = years
+        self.invalid = np.flatnonzero(~valid).tolist()
+        _log_invalid_dates(column.iloc[self.invalid].tolist())
+
+        positions = np.flatnonzero(valid)
+        groups = pd.Series(positions).groupby(
+            [months[positions], days[positions]]
+        ).indices
+        self.buckets = {
+            (int(month), int(day)): positions[idx]
+            for (month, day), idx in groups.items()
+        }
+
+    def _index_records(self, records, dates=None):
+        self.records = []
+        self._fetch = lambda positions: [self.records[p].to_dict() for p in positions]
+        invalid_values = []
+        for position, record in enumerate(records):
+            self.records.append(record)
+            self.zones.append((record.get(TIMEZONE_COLUMN) or '').strip())
+            if dates is not None:
+                parsed = dates[position]
+            else:
+                parsed = parse_birth_date(record.get('fecha de nacimiento'))
+            if parsed is None:
+                self.years.append(0)
+                self.invalid.append(position)
+                invalid_values.append(record.get('fecha de nacimiento'))
+                continue
+            year, month, day = parsed
+            self.years.append(year)
+            self.buckets.setdefault((month, day), []).append(position)
+        _log_invalid_dates(invalid_values)
+
+    @classmethod
+    def from_state(cls, records, buckets, years, invalid, zones=()):
+        """Reconstruye un índice ya calculado, p. ej. desde una instantánea."""
+        index = cls([])
+        index.records = list(records)
+        index.buckets = buckets
+        index.years = years
+        index.invalid = invalid
+        index.zones = list(zones)
+        return index
+
+    def __len__(self):
+        return len(self.years)
+
+    def _rows(self, positions, date):
+        result = []
+        for position, row in zip(positions, self._fetch(positions)):
+            year = self.years[position]
+            if year:
+                row['edad'] = date.year - int(year)
+            result.append(row)
+        return result
+
+    def zone_names(self):
+        """Zonas horarias distintas de la hoja ('' para las filas sin zona)."""
+        if getattr(self, '_zone_names', None) is None:
+            self._zone_names = set(self.zones) if self.zones else set()
+            if len(self.zones) < len(self):
+                self._zone_names.add('')
+        return self._zone_names
+
+    def lookup(self, date, zones=None):
+        """Devuelve las filas (como dict) con cumpleaños en la fecha dada.
+
+        Quienes nacieron un 29 de febrero lo celebran el 28 en años no bisiestos.
+        Con zones solo se devuelven las filas cuya zona horaria está en el
+        conjunto; el filtro recorre solo los cumpleaños del día.
+        """
+        positions = list(self.buckets.get((date.month, date.day), ()))
+        if _is_feb_28_of_common_year(date):
+            positions.extend(self.buckets.get((2, 29), ()))
+        if zones is not None:
+            count = len(self.zones)
+            positions = [p for p in positions if (self.zones[p] if p < count else '') in zones]
+        if not positions:
+            return []
+        return self._rows(positions, date)
+
+    def _day_index(self):
+        """Días del año (calendario bisiesto) ordenados, con sus posiciones."""
+        if getattr(self, '_sorted_days', None) is None:
+            days = sorted(
+                (_leap_ordinal(month, day), positions)
+                for (month, day), positions in self.buckets.items()
+                if day <= _LEAP_MONTH_DAYS[month - 1]
+            )
+            self._sorted_days = ([ordinal for ordinal, _ in days], [positions for _, positions in days])
+        return self._sorted_days
+
+    def birthdays_between(self, start, end):
+        """Devuelve [(fecha, fila)] con los cumpleaños entre start y end, ambos incluidos.
+
+        Busca con bisect sobre los días del año ordenados, así que el costo
+        depende de los cumpleaños encontrados y no del tamaño de la hoja ni
+        del rango. El rango puede cruzar el fin de año; los nacidos un 29 de
+        febrero aparecen el 28 en años no bisiestos.
+        """
+        ordinals, buckets = self._day_index()
+        result = []
+        for year in range(start.year, end.year + 1):
+            first = start if year == start.year else datetime.date(year, 1, 1)
+            last = end if year == end.year else datetime.date(year, 12, 31)
+            if first > last:
+                continue
+            low = _leap_ordinal(first.month, first.day)
+            high = _leap_ordinal(last.month, last.day)
+            leap = calendar.isleap(year)
+            if not leap and (last.month, last.day) == (2, 28):
+                high += 1  # incluye a los nacidos el 29 de febrero
+            for i in range(bisect.bisect_left(ordinals, low), bisect.bisect_right(ordinals, high)):
+                month, day = _LEAP_ORDINAL_DATES[ordinals[i]]
+                if not leap and (month, day) == (2, 29):
+                    day = 28
+                date = datetime.date(year, month, day)
+                result.extend((date, row) for row in self._rows(buckets[i], date))
+        result.sort(key=lambda item: item[0])
+        return result
+
+def get_today_birthdays(df, index=None, date=None):
     """Devuelve lista de filas con cumpleaños hoy (formato YYYY/MM/DD o MM/DD)."""
-    today = datetime.date.today()
     if 'fecha de nacimiento' not in df.columns:
         return []
-    result = []
-    for _, row in df.iterrows():
-        splitted_date = str(row['fecha de nacimiento']).split('/')
-        year = None
-        if len(splitted_date) == 3:  # Formato YYYY/MM/DD
-            year, month, day = map(int, splitted_date)
-        elif len(splitted_date) == 2:  # Formato MM/DD
-            month, day = map(int, splitted_date)
-        else:
-            logging.info(f"Formato de fecha no válido: {row['fecha de nacimiento']}")
-            continue  # Formato no válido
-        if month == today.month and day == today.day:
-            current_row = row.to_dict()
-            if year is not None:
-                current_row['edad'] = today.year - year
-            result.append(current_row)
+    if index is None:
+        index = BirthdayIndex(df)
+    return index.lookup(date or datetime.date.today())
 
-    return result
+def today_in(timezone=None):
+    """Fecha actual en la zona horaria IANA dada, o en la local si es None."""
+    if not timezone:
+        return datetime.date.today()
+    from zoneinfo import ZoneInfo
+    return datetime.datetime.now(ZoneInfo(timezone)).date()
+
+def zones_at_hour(zone_names, hour, default_zone=None, now=None):
+    """Agrupa las zonas por su desfase UTC actual y elige las que están en hour.
+
+    Devuelve {fecha local: conjunto de zonas} con las zonas donde la hora
+    local actual es hour, así cada ejecución por hora solo toca esas filas.
+    La zona '' (filas sin zona) y los nombres inválidos usan default_zone.
+    El desfase se calcula en cada ejecución, de modo que los cambios de
+    horario de verano se respetan.
+    """
+    from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    default = ZoneInfo(default_zone) if default_zone else None
+    by_offset = {}
+    invalid = []
+    for name in zone_names:
+        try:
+            zone = ZoneInfo(name) if name else default
+        except (ZoneInfoNotFoundError, ValueError):
+            invalid.append(name)
+            zone = default
+        local = now.astimezone(zone)
+        by_offset.setdefault(local.utcoffset(), (local, set()))[1].add(name)
+    if invalid:
+        metrics.incr('zonas_invalidas', len(invalid))
+        logging.warning(f"Zonas horarias inválidas, se usa la predeterminada: {', '.join(invalid)}")
+
+    due = {}
+    for offset, (local, names) in by_offset.items():
+        if local.hour == hour:
+            logging.info(f"Son las {local:%H:%M} en UTC{local:%z} ({len(names)} zonas)")
+            due.setdefault(local.date(), set()).update(names)
+    return due
 
-def generate_birthday_message(person_data):
-    """Genera un mensaje de cumpleaños con Gemini."""
+def load_birthday_index(sheets_service, config):
+    """Construye el índice de cumpleaños de toda la hoja con el lector configurado."""
+    if config.index_loader is not None:
+        return config.index_loader(sheets_service, config)
+    if config.sheet_reader == 'stream':
+        return BirthdayIndex(iter_sheet_records(sheets_service, config))
+    if config.sheet_reader == 'columns':
+        return read_sheet_columns(sheets_service, config)
+    return BirthdayIndex(read_sheet_data(sheets_service, config))
+
+def match_birthdays(records, date):
+    """Filtra en streaming los registros con cumpleaños en la fecha dada.
+
+    Solo conserva en memoria las coincidencias. Devuelve (filas como dict,
+    número de filas recorridas).
+    """
+    result = []
+    invalid_values = []
+    scanned = 0
+    for record in records:
+        scanned += 1
+        parsed = parse_birth_date(record.get('fecha de nacimiento'))
+        if parsed is None:
+            invalid_values.append(record.get('fecha de nacimiento'))
+            continue
+        year, month, day = parsed
+        if (month, day) == (date.month, date.day) or (
+                (month, day) == (2, 29) and _is_feb_28_of_common_year(date)):
+            row = record.to_dict()
+            if year:
+                row['edad'] = date.year - year
+            result.append(row)
+    _log_invalid_dates(invalid_values)
+    return result, scanned
+
+def _describe_person(person_data):
+    """Devuelve (nombre con género y edad, parentesco) para los prompts."""
     nombre = person_data.get('nombre')
     edad = person_data.get('edad')
     parentesco = person_data.get('parentesco')
     genero = person_data.get('genero')
     if not parentesco:
         parentesco = 'conocido/a'
-    if genero:
-        msg_genero = f" (género {genero})"
-    if edad:
-        msg_edad = f" que cumple {edad} años"
-    prompt = (
-        f"Genera un mensaje de cumpleaños corto y cálido para {nombre}{msg_genero}{msg_edad}. "
+    msg_genero = f" (género {genero})" if genero else ''
+    msg_edad = f" que cumple {edad} años" if edad else ''
+    return f"{nombre}{msg_genero}{msg_edad}", parentesco
+
+def build_birthday_prompt(person_data):
+    """Construye el prompt para Gemini a partir de los datos de la persona."""
+    descripcion, parentesco = _describe_person(person_data)
+    nombre = person_data.get('nombre')
+    return (
+        f"Genera un mensaje de cumpleaños corto y cálido para {descripcion}. "
         f"{nombre} es mi: {parentesco}. "
         "No incluyas firma ni nombre del remitente."
     )
+
+def build_batch_prompt(people):
+    """Construye un único prompt que pide los mensajes de varias personas en JSON."""
+    lines = []
+    for position, person in enumerate(people):
+        descripcion, parentesco = _describe_person(person)
+        lines.append(f"- id {position}: {descripcion}, que es mi: {parentesco}")
+    return (
+        "Genera un mensaje de cumpleaños corto y cálido para cada una de estas personas:\n"
+        + "\n".join(lines) + "\n"
+        "Responde solo con un arreglo JSON de objetos {\"id\": <id>, \"mensaje\": <texto>}, "
+        "uno por persona. No incluyas firma ni nombre del remitente."
+    )
+
+def parse_batch_response(text, count):
+    """Extrae los mensajes de la respuesta JSON de Gemini.
+
+    Devuelve una lista de longitud count con None en las posiciones que no
+    se pudieron leer.
+    """
+    messages = [None] * count
+    text = text.strip()
+    if text.startswith('```'):
+        text = text.strip('`').removeprefix('json').strip()
     try:
-        model = genai.GenerativeModel('gemini-2.5-flash-preview-05-20')
-        logging.debug(f"Prompt enviado a Gemini: {prompt}")
-        response = model.generate_content(prompt).text.strip()
-        logging.debug(f"Respuesta recibida de Gemini: {response}")
-        return response
+        entries = json.loads(text)
+    except ValueError:
+        return messages
+    if not isinstance(entries, list):
+        return messages
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        try:
+            position = int(entry.get('id'))
+        except (TypeError, ValueError):
+            continue
+        message = entry.get('mensaje')
+        if 0 <= position < count and isinstance(message, str) and message.strip():
+            messages[position] = message.strip()
+    return messages
+
+def request_birthday_message(prompt, deadline=None):
+    """Pide el mensaje a Gemini; propaga cualquier error de la API."""
+    model = get_gemini_model()
+    logging.debug(f"Prompt enviado a Gemini: {prompt}")
+    def generate():
+        with metrics.span('gemini.generate'):
+            return model.generate_content(prompt).text.strip()
+    response = ratelimit.get_limiter('gemini').call(generate, deadline=deadline)
+    logging.debug(f"Respuesta recibida de Gemini: {response}")
+    metrics.incr('mensajes_generados')
+    return response
+
+def request_birthday_messages(people, deadline=None):
+    """Pide a Gemini los mensajes de varias personas en una sola llamada.
+
+    Devuelve una lista alineada con people, con None para las entradas que
+    no venían en la respuesta; propaga cualquier error de la API.
+    """
+    if len(people) == 1:
+        return [request_birthday_message(build_birthday_prompt(people[0]), deadline)]
+    prompt = build_batch_prompt(people)
+    logging.debug(f"Prompt enviado a Gemini: {prompt}")
+    model = get_gemini_model()
+
+    def generate():
+        with metrics.span('gemini.generate_batch'):
+            return model.generate_content(
+                prompt, generation_config={'response_mime_type': 'application/json'}
+            ).text
+    response = ratelimit.get_limiter('gemini').call(generate, deadline=deadline)
+    logging.debug(f"Respuesta recibida de Gemini: {response}")
+    messages = parse_batch_response(response, len(people))
+    metrics.incr('mensajes_generados', sum(message is not None for message in messages))
+    return messages
+
+def generate_birthday_message(person_data, deadline=None):
+    """Genera un mensaje de cumpleaños con Gemini.
+
+    Los errores 429 y 5xx se reintentan con backoff (ver ratelimit.py); solo
+    si se agotan los intentos se usa el mensaje genérico. Si no queda tiempo
+    antes de deadline se propaga ratelimit.DeadlineExceeded, para que la
+    persona quede pendiente en vez de recibir el mensaje genérico.
+    """
+    prompt = build_birthday_prompt(person_data)
+    try:
+        return request_birthday_message(prompt, deadline)
+    except ratelimit.DeadlineExceeded:
+        raise
     except Exception as e:
         logging.exception("Error al generar mensaje con Gemini")
-        return f"¡Feliz cumpleaños, {nombre}! 🎉"
+        metrics.incr('mensajes_fallback')
+        return f"¡Feliz cumpleaños, {person_data.get('nombre')}! 🎉"
+
+def generate_birthday_messages(people, deadline=None):
+    """Genera los mensajes de varias personas con una sola llamada a Gemini.
+
+    Las entradas que fallen en la llamada agrupada se generan una a una con
+    generate_birthday_message.
+    """
+    try:
+        messages = request_birthday_messages(people, deadline)
+    except ratelimit.DeadlineExceeded:
+        raise
+    except Exception:
+        logging.exception("Error al generar mensajes agrupados con Gemini")
+        messages = [None] * len(people)
+    missing = sum(message is None for message in messages)
+    if missing and len(people) > 1:
+        logging.info(f"{missing} mensajes sin respuesta agrupada, se generan uno a uno")
+    return [
+        message if message is not None else generate_birthday_message(person, deadline)
+        for person, message in zip(people, messages)
+    ]
 
 def read_sheet_data(service, config):
     """Lee datos de Google Sheets en un DataFrame."""
+    _import_pandas()
     try:
-        result = service.spreadsheets().values().get(
-            spreadsheetId=config.spreadsheet_id, range=config.range_name
-        ).execute()
+        def fetch():
+            with metrics.span('sheets.get'):
+                return service.spreadsheets().values().get(
+                    spreadsheetId=config.spreadsheet_id, range=config.range_name
+                ).execute()
+        result = ratelimit.get_limiter('sheets').call(fetch, deadline=work_deadline(config))
         vals = result.get('values', [])
         if not vals:
             return pd.DataFrame()
         headers = [h.strip().lower() for h in vals[0]]
         return pd.DataFrame(vals[1:], columns=headers)
+    except ratelimit.DeadlineExceeded:
+        raise
     except Exception as e:
         logging.exception("Error al leer Google Sheet")
         return pd.DataFrame()
 
-def send_birthday_email(service, to_email, subject, message_body, from_email):
-    """Envía correo usando Gmail API con OAuth."""
+_RANGE_RE = re.compile(r"^(?:(?P<sheet>.+)!)?(?P<first>[A-Z]+)\d*:(?P<last>[A-Z]+)\d*$")
+
+def iter_sheet_records(service, config, page_size=None):
+    """Lee la hoja por páginas de filas y genera registros Contact.
+
+    A diferencia de read_sheet_data no necesita pandas ni descarga la hoja
+    completa de una vez: cada página se procesa antes de pedir la siguiente,
+    así que la memoria no crece con el tamaño de la hoja. Se pagina hasta la
+    última fila de la cuadrícula (gridProperties.rowCount) y no hasta la
+    primera página corta, porque Sheets omite las filas vacías al final de
+    cada página y una página con filas en blanco no indica el fin de la hoja.
+    Con config.deadline no se pide ninguna página pasado work_deadline: se
+    lanza ratelimit.DeadlineExceeded.
+    """
+    page_size = page_size or config.sheet_page_size
+    match = _RANGE_RE.match(config.range_name)
+    if not match:
+        raise ValueError(f"Rango no soportado para lectura por páginas: {config.range_name}")
+    prefix = f"{match['sheet']}!" if match['sheet'] else ''
+    first, last = match['first'], match['last']
+    values = service.spreadsheets().values()
+
+    limiter = ratelimit.get_limiter('sheets')
+
+    def fetch(start, end):
+        def request():
+            with metrics.span('sheets.get'):
+                return values.get(
+                    spreadsheetId=config.spreadsheet_id,
+                    range=f"{prefix}{first}{start}:{last}{end}"
+                ).execute()
+        if out_of_time(config):
+            raise ratelimit.DeadlineExceeded("plazo de la ejecución al leer la hoja")
+        return limiter.call(request, deadline=work_deadline(config)).get('values', [])
+
+    header_rows = fetch(1, 1)
+    if not header_rows:
+        return
+    header = SheetHeader(header_rows[0])
+
+    def grid():
+        with metrics.span('sheets.metadata'):
+            return service.spreadsheets().get(
+                spreadsheetId=config.spreadsheet_id, ranges=[f"{prefix}{first}1"],
+                fields='sheets(properties(gridProperties(rowCount)))'
+            ).execute()
+    sheets = limiter.call(grid, deadline=work_deadline(config)).get('sheets') or [{}]
+    row_count = sheets[0].get('properties', {}).get('gridProperties', {}).get('rowCount', 0)
+
+    start = 2
+    while start <= row_count:
+        for row in fetch(start, start + page_size - 1):
+            if row:  # las filas en blanco en medio de la página llegan como []
+                yield Contact(header, row)
+        start += page_size
+
+# Columnas que usa el bot; las que no estén en la hoja simplemente se omiten
+SHEET_COLUMNS = (
+    'nombre', 'correo electrónico', 'fecha de nacimiento', 'parentesco', 'genero', TIMEZONE_COLUMN
+)
+SERIAL_EPOCH = datetime.date(1899, 12, 30)  # día 0 de los números de serie de Sheets
+_NUMPY_MIN_DATES = 5000  # por debajo, convertir a arreglos cuesta más que el bucle en Python
+
+# (spreadsheet_id, rango) -> {columna: letra}; se reutiliza en instancias calientes
+_column_cache = {}
+
+def _column_letter(number):
+    """Letra de columna de Sheets para un número 1-based (1 -> A, 27 -> AA)."""
+    letters = ''
+    while number:
+        number, remainder = divmod(number - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+def _column_number(letters):
+    number = 0
+    for letter in letters:
+        number = number * 26 + ord(letter) - ord('A') + 1
+    return number
+
+def decode_serial_dates(serials):
+    """Decodifica en bloque números de serie de Sheets a (año, mes, día).
+
+    Con muchas fechas y numpy ya importado (p. ej. por pandas) se convierten
+    con datetime64 en una sola operación; si no, con date.fromordinal, sin
+    pagar la importación de numpy en el arranque en frío.
+    """
+    numpy = sys.modules.get('numpy')
+    if numpy is not None and len(serials) >= _NUMPY_MIN_DATES:
+        offsets = numpy.floor(numpy.asarray(serials, dtype=float)).astype('timedelta64[D]')
+        dates = numpy.datetime64(SERIAL_EPOCH.isoformat()) + offsets
+        month_starts = dates.astype('datetime64[M]')
+        years = dates.astype('datetime64[Y]').astype(int) + 1970
+        months = month_starts.astype(int) % 12 + 1
+        days = (dates - month_starts).astype(int) + 1
+        return list(zip(years.tolist(), months.tolist(), days.tolist()))
+    epoch = SERIAL_EPOCH.toordinal()
+    result = []
+    for serial in serials:
+        date = datetime.date.fromordinal(epoch + int(serial))
+        result.append((date.year, date.month, date.day))
+    return result
+
+def _decode_birth_dates(values):
+    """Decodifica la columna de fechas leída sin formato.
+
+    Las celdas con tipo fecha llegan como números de serie y se decodifican
+    juntas, siempre con su año; las de texto (YYYY/MM/DD o MM/DD) se parsean
+    como siempre. Solo un texto MM/DD cuenta como fecha sin año: Sheets
+    completa con el año en curso un MM/DD escrito en una celda con tipo
+    fecha, y ese año no se distingue de uno real. Devuelve (fechas, valores
+    normalizados).
+    """
+    dates = [None] * len(values)
+    normalized = list(values)
+    numeric, serials = [], []
+    for i, value in enumerate(values):
+        if type(value) in (int, float) and value > 0:
+            numeric.append(i)
+            serials.append(value)
+        else:
+            dates[i] = parse_birth_date(value)
+    for i, (year, month, day) in zip(numeric, decode_serial_dates(serials)):
+        dates[i] = (year, month, day)
+        normalized[i] = f"{year}/{month:02d}/{day:02d}"
+    return dates, normalized
+
+def _resolve_columns(service, config, prefix, first, last):
+    """Lee una vez la fila de encabezados y ubica las columnas que usa el bot."""
+    key = (config.spreadsheet_id, config.range_name)
+    mapping = _column_cache.get(key)
+    if mapping is None:
+        def fetch():
+            with metrics.span('sheets.get'):
+                return service.spreadsheets().values().get(
+                    spreadsheetId=config.spreadsheet_id, range=f"{prefix}{first}1:{last}1"
+                ).execute()
+        header = (ratelimit.get_limiter('sheets').call(
+            fetch, deadline=work_deadline(config)
+        ).get('values') or [[]])[0]
+        offset = _column_number(first)
+        mapping = {}
+        for i, name in enumerate(SheetHeader(header).names):
+            if name in SHEET_COLUMNS and name not in mapping:
+                mapping[name] = _column_letter(offset + i)
+        _column_cache[key] = mapping
+    return mapping
+
+def read_sheet_columns(service, config, retry=True):
+    """Lee solo las columnas que usa el bot, con valores sin formato, y las indexa.
+
+    Los encabezados se resuelven una vez por hoja y se guardan en caché; cada
+    columna se pide desde la fila 1 en un solo batchGet, así que si alguien
+    reordena la hoja el encabezado recibido no coincide y la caché se
+    renueva. Las fechas llegan como números de serie (sin depender del
+    formato regional de la hoja) y se decodifican en bloque. Devuelve un
+    BirthdayIndex.
+    """
+    match = _RANGE_RE.match(config.range_name)
+    if not match:
+        raise ValueError(f"Rango no soportado para lectura por columnas: {config.range_name}")
+    prefix = f"{match['sheet']}!" if match['sheet'] else ''
+    mapping = _resolve_columns(service, config, prefix, match['first'], match['last'])
+    if not mapping:
+        return BirthdayIndex([])
+    names = list(mapping)
+
+    def fetch():
+        with metrics.span('sheets.batchGet'):
+            return service.spreadsheets().values().batchGet(
+                spreadsheetId=config.spreadsheet_id,
+                ranges=[f"{prefix}{mapping[name]}:{mapping[name]}" for name in names],
+                majorDimension='COLUMNS',
+                valueRenderOption='UNFORMATTED_VALUE',
+                dateTimeRenderOption='SERIAL_NUMBER',
+            ).execute()
+    value_ranges = ratelimit.get_limiter('sheets').call(
+        fetch, deadline=work_deadline(config)
+    ).get('valueRanges', [])
+    columns = [(value_range.get('values') or [[]])[0] for value_range in value_ranges]
+
+    received = [str(column[0]).strip().lower() if column else '' for column in columns]
+    if received != names:
+        _column_cache.pop((config.spreadsheet_id, config.range_name), None)
+        if retry:
+            logging.info("Los encabezados de la hoja cambiaron, se vuelven a resolver")
+            return read_sheet_columns(service, config, retry=False)
+        raise ValueError(f"Encabezados inesperados en la hoja: {received}")
+
+    count = max(len(column) for column in columns) - 1
+    cells = []
+    dates = None
+    for name, column in zip(names, columns):
+        values = column[1:] + [''] * (count - len(column) + 1)
+        if name == 'fecha de nacimiento':
+            dates, values = _decode_birth_dates(values)
+        else:
+            values = list(map(str, values))
+        cells.append(values)
+    header = SheetHeader(names)
+    records = [Contact(header, row) for row in zip(*cells)]
+    if dates is None:
+        return BirthdayIndex(records)
+    return BirthdayIndex(records, dates)
+
+def build_email_message(to_email, subject, message_body, from_email):
+    """Construye el cuerpo codificado que espera messages().send."""
     message = MIMEText(message_body)
     message['to'] = to_email
     message['from'] = from_email
     message['subject'] = subject
 
-    encoded_message = urlsafe_b64encode(message.as_bytes()).decode()
-    
+    return {'raw': urlsafe_b64encode(message.as_bytes()).decode()}
+
+def send_birthday_email(service, to_email, subject, message_body, from_email, http=None,
+                        deadline=None):
+    """Envía correo usando Gmail API con OAuth.
+
+    Respeta la tasa configurada para Gmail y reintenta los 429 y 5xx con
+    backoff; los demás errores, o los que persisten, se propagan. Si no hay
+    tiempo antes de deadline para esperar la cuota o reintentar se lanza
+    ratelimit.DeadlineExceeded.
+    """
+    body = build_email_message(to_email, subject, message_body, from_email)
+
+    def send():
+        with metrics.span('gmail.send'):
+            service.users().messages().send(userId='me', body=body).execute(http=http)
+
     try:
-        service.users().messages().send(
-            userId='me',
-            body={'raw': encoded_message}
-        ).execute()
+        ratelimit.get_limiter('gmail').call(send, deadline=deadline)
         logging.info(f"Correo enviado a {to_email}")
     except Exception as error:
         logging.error(f'Ocurrió un error al enviar el correo: {error}')
         raise
 
-def process_birthdays(sheets_service, gmail_service, config, from_email):
-    """Procesa los cumpleaños del día y envía los correos."""
-    logging.info("Iniciando procesamiento de cumpleaños")
-    
-    df = read_sheet_data(sheets_service, config)
-    if df.empty:
-        logging.info("No hay datos o error al leer la hoja.")
-        return
+def send_birthday_emails_batch(service, emails, from_email, batch_size=50, deadline=None):
+    """Envía varios correos agrupados en peticiones HTTP batch de Gmail.
 
-    logging.info(f"Datos leídos exitosamente de Google Sheets: {len(df)} filas")
-    birthdays = get_today_birthdays(df)
-    if not birthdays:
-        logging.info("No hay cumpleaños hoy.")
-        return
+    emails es una lista de tuplas (to_email, subject, message_body). Devuelve
+    una lista alineada con emails: None si el correo se envió, o la excepción
+    del fallo. Un correo fallido no afecta al resto del lote. Cada correo
+    del lote cuenta contra la tasa de Gmail, y los que reciben 429 o 5xx se
+    reenvían en un lote posterior tras esperar con backoff. Los correos que
+    no se llegan a enviar o reintentar antes de deadline quedan con
+    ratelimit.DeadlineExceeded.
+    """
+    errors = [None] * len(emails)
+    batch_size = max(1, min(batch_size, 100))  # Gmail admite hasta 100 por lote
+    limiter = ratelimit.get_limiter('gmail')
 
-    logging.info(f"Hoy hay {len(birthdays)} cumpleaños:")
+    for start in range(0, len(emails), batch_size):
+        pending = list(range(start, min(start + batch_size, len(emails))))
+        if deadline is not None and time.monotonic() >= deadline:
+            for position in range(start, len(emails)):
+                errors[position] = ratelimit.DeadlineExceeded("sin tiempo para enviar el lote")
+            break
+
+        for attempt in range(1, limiter.attempts + 1):
+            last_attempt = attempt == limiter.attempts
+            retry = []
+            answered = set()
+
+            def callback(request_id, response, exception):
+                position = int(request_id)
+                answered.add(position)
+                to_email = emails[position][0]
+                if exception is None:
+                    logging.info(f"Correo enviado a {to_email}")
+                elif not last_attempt and ratelimit.is_retryable(exception):
+                    retry.append(position)
+                else:
+                    errors[position] = exception
+                    logging.error(f'Ocurrió un error al enviar el correo a {to_email}: {exception}')
+
+            batch = service.new_batch_http_request(callback=callback)
+            for position in pending:
+                to_email, subject, message_body = emails[position]
+                body = build_email_message(to_email, subject, message_body, from_email)
+                batch.add(
+                    service.users().messages().send(userId='me', body=body),
+                    request_id=str(position)
+                )
+            try:
+                limiter.bucket.acquire(len(pending), deadline)
+            except ratelimit.DeadlineExceeded as error:
+                for position in pending:
+                    errors[position] = error
+                break
+            try:
+                with metrics.span('gmail.batch'):
+                    batch.execute()
+            except Exception as error:
+                unanswered = [position for position in pending if position not in answered]
+                if not last_attempt and ratelimit.is_retryable(error):
+                    retry.extend(unanswered)
+                else:
+                    logging.error(f'Ocurrió un error al enviar el lote de correos: {error}')
+                    for position in unanswered:
+                        errors[position] = error
+            if not retry:
+                break
+            logging.info(f"{len(retry)} correos del lote con error temporal, reintento {attempt}")
+            if not limiter.backoff(attempt, deadline):
+                for position in retry:
+                    errors[position] = ratelimit.DeadlineExceeded("sin tiempo para reintentar el lote")
+                break
+            pending = sorted(retry)
+
+    return errors
+
+def _new_http(service):
+    """Crea un transporte HTTP propio para usar el servicio desde otro hilo.
+
+    Los objetos de googleapiclient comparten un httplib2.Http que no es
+    seguro entre hilos, así que cada hilo de envío necesita el suyo.
+    """
+    credentials = getattr(getattr(service, '_http', None), 'credentials', None)
+    if credentials is None:
+        return None
+    import httplib2
+    import google_auth_httplib2
+    return google_auth_httplib2.AuthorizedHttp(credentials, http=httplib2.Http())
+
+_STOP = object()
+
+def run_birthday_pipeline(people, gmail_service, config, from_email, date=None):
+    """Genera y envía los mensajes en dos etapas concurrentes unidas por colas.
+
+    La generación con Gemini y el envío por Gmail corren en pools de hilos
+    separados (config.generate_workers y config.send_workers), de modo que
+    la latencia de ambas APIs se solapa. Con config.send_mode == 'batch' los
+    mensajes generados se acumulan y se envían en lotes HTTP al final. Si
+    config.message_cache tiene un mensaje pregenerado para la persona y la
+    fecha, se usa sin llamar a Gemini y se borra de la caché solo cuando el
+    correo se envió; el resto se pide a Gemini en grupos de
+    config.gemini_batch_size personas. Con config.outbox cada mensaje queda
+    registrado antes de enviarse (el registro se guarda una vez por grupo y
+    al final) y se reserva con outbox.claim() justo antes del envío: si el
+    trigger se repite, los ya enviados o en envío en otra ejecución se
+    omiten y los pendientes se reenvían sin regenerarlos. Un fallo con una
+    persona se registra y no detiene el resto. Con config.deadline no se
+    empieza a generar ni a enviar nada cuando quedan menos de
+    config.deadline_margin segundos, y las esperas de cuota y los reintentos
+    no pasan de ese punto (ver work_deadline; el lote final del modo batch
+    puede usar el margen hasta config.deadline); esas personas, incluidas las
+    que ya tienen el mensaje generado pero sin enviar, quedan en
+    'pendientes' para continuar en otra invocación.
+    Devuelve dict con los nombres enviados, fallidos y omitidos, y las
+    tuplas (fecha, persona) pendientes.
+    """
+    date = date or datetime.date.today()
+    batch_mode = config.send_mode == 'batch'
+    generate_workers = max(1, config.generate_workers)
+    send_workers = 0 if batch_mode else max(1, config.send_workers)
+    generate_queue = queue.Queue()
+    send_queue = queue.Queue(maxsize=0 if batch_mode else send_workers * 2)
+    results = {'enviados': [], 'fallidos': [], 'omitidos': [], 'pendientes': []}
+    lock = threading.Lock()
+    outbox = config.outbox
+    deadline = work_deadline(config)
+
+    def record(key, nombre):
+        with lock:
+            results[key].append(nombre)
+
+    def ledger(method, *args):
+        # Un error del registro no debe impedir el envío
+        if outbox is None:
+            return None
+        try:
+            return getattr(outbox, method)(*args)
+        except Exception:
+            logging.exception(f"Error en el registro de envíos ({method})")
+            return None
+
+    def claimed(person, msg):
+        # Sin registro, o si el registro falla, se envía igual
+        if ledger('claim', person, date, msg) is not False:
+            return True
+        logging.info(f"Correo a {person.get('nombre')} ya enviado o en envío en otra ejecución, se omite")
+        record('omitidos', person.get('nombre'))
+        metrics.incr('correos_omitidos')
+        return False
+
+    def hand_off(ready):
+        # Los mensajes del grupo quedan guardados en el registro antes de enviarse
+        ledger('flush')
+        for item in ready:
+            send_queue.put(item)
+
+    def postpone(people, error=None):
+        # El mensaje ya registrado se reutiliza al continuar; se libera la reserva
+        if error is not None:
+            for person in people:
+                ledger('mark_failed', person, date, error)
+        with lock:
+            results['pendientes'].extend((date, person) for person in people)
+
+    def sent(person, error):
+        if isinstance(error, ratelimit.DeadlineExceeded):
+            postpone([person], error)
+        elif error is None:
+            ledger('mark_sent', person, date)
+            if config.message_cache is not None:
+                try:
+                    config.message_cache.discard(person, date)
+                except Exception:
+                    logging.exception("Error al actualizar la caché de mensajes")
+            record('enviados', person.get('nombre'))
+            metrics.incr('correos_enviados')
+        else:
+            ledger('mark_failed', person, date, error)
+            record('fallidos', person.get('nombre'))
+            metrics.incr('correos_fallidos')
+
+    def generator():
+        while True:
+            group = generate_queue.get()
+            if group is _STOP:
+                return
+            if out_of_time(config):
+                postpone(group)
+                continue
+            pending, ready = [], []
+            for person in group:
+                entry = ledger('get', person, date)
+                if entry is not None and entry['estado'] == 'enviado':
+                    logging.info(f"Correo a {person.get('nombre')} ya enviado hoy, se omite")
+                    record('omitidos', person.get('nombre'))
+                    metrics.incr('correos_omitidos')
+                    continue
+                if entry is not None:
+                    metrics.incr('mensajes_del_registro')
+                    ready.append((person, entry['mensaje']))
+                    continue
+                msg = None
+                if config.message_cache is not None:
+                    try:
+                        msg = config.message_cache.peek(person, date)
+                    except Exception:
+                        logging.exception("Error al leer la caché de mensajes")
+                if msg:
+                    metrics.incr('mensajes_de_cache')
+                    ledger('enqueue', person, date, msg)
+                    ready.append((person, msg))
+                else:
+                    pending.append(person)
+            if not pending:
+                hand_off(ready)
+                continue
+            try:
+                resolve(config.gemini_setup)
+                if len(pending) == 1:
+                    messages = [generate_birthday_message(pending[0], deadline)]
+                else:
+                    messages = generate_birthday_messages(pending, deadline)
+            except ratelimit.DeadlineExceeded:
+                postpone(pending)
+                hand_off(ready)
+                continue
+            except Exception:
+                logging.exception(
+                    f"Error al preparar los mensajes de {[p.get('nombre') for p in pending]}"
+                )
+                for person in pending:
+                    record('fallidos', person.get('nombre'))
+                metrics.incr('correos_fallidos', len(pending))
+                hand_off(ready)
+                continue
+            for person, msg in zip(pending, messages):
+                ledger('enqueue', person, date, msg)
+                ready.append((person, msg))
+            hand_off(ready)
+
+    def sender():
+        http = _new_http(gmail_service) if send_workers > 1 else None
+        while True:
+            item = send_queue.get()
+            if item is _STOP:
+                return
+            person, msg = item
+            if out_of_time(config):
+                postpone([person])
+                continue
+            if not claimed(person, msg):
+                continue
+            nombre = person.get('nombre')
+            subject = f"¡Feliz Cumpleaños, {nombre}!"
+            try:
+                send_birthday_email(
+                    gmail_service, person.get('correo electrónico'), subject, msg,
+                    from_email, http=http, deadline=deadline
+                )
+            except Exception as error:
+                sent(person, error)
+            else:
+                sent(person, None)
+
+    group_size = max(1, config.gemini_batch_size)
+    for start in range(0, len(people), group_size):
+        generate_queue.put(people[start:start + group_size])
+    for _ in range(generate_workers):
+        generate_queue.put(_STOP)
+
+    with ThreadPoolExecutor(generate_workers) as generate_pool, \
+            ThreadPoolExecutor(max(1, send_workers)) as send_pool:
+        senders = [send_pool.submit(metrics.bind(sender)) for _ in range(send_workers)]
+        generators = [generate_pool.submit(metrics.bind(generator)) for _ in range(generate_workers)]
+        for future in generators:
+            future.result()
+        for _ in senders:
+            send_queue.put(_STOP)
+        for future in senders:
+            future.result()
+
+    if batch_mode:
+        ready = [send_queue.get() for _ in range(send_queue.qsize())]
+        # El lote final puede usar el margen: si no, una generación que llega
+        # hasta work_deadline nunca dejaría tiempo para enviar
+        remaining = time_left(config)
+        if remaining is not None and remaining <= 0:
+            postpone([person for person, _ in ready])
+            ready = []
+        ready = [(person, msg) for person, msg in ready if claimed(person, msg)]
+        emails = [
+            (person.get('correo electrónico'), f"¡Feliz Cumpleaños, {person.get('nombre')}!", msg)
+            for person, msg in ready
+        ]
+        errors = send_birthday_emails_batch(
+            gmail_service, emails, from_email, config.email_batch_size, config.deadline
+        ) if emails else []
+        for (person, _), error in zip(ready, errors):
+            sent(person, error)
+    ledger('flush')
+    if config.message_cache is not None:
+        # Sin evict_before: otras zonas pueden necesitar aún mensajes de fechas
+        # anteriores a date; los limpia el job de pregeneración
+        config.message_cache.save()
+
+    if results['pendientes']:
+        metrics.incr('pendientes', len(results['pendientes']))
+        logging.warning(
+            f"Tiempo agotado: {len(results['pendientes'])} personas quedan pendientes"
+        )
+    return results
+
+def deliver_birthdays(birthdays, gmail_service, config, from_email, date):
+    """Genera y envía los mensajes de los cumpleañeros con correo.
+
+    gmail_service puede ser un Lazy: solo se construye si hay a quién escribir.
+    """
+    people = []
     for person in birthdays:
         correo = person.get('correo electrónico')
         nombre = person.get('nombre')
         if not correo or not nombre:
             logging.info(f"Saltando {nombre}, sin correo.")
             continue
+        people.append(person)
+
+    if not people:
+        logging.info("Nadie con correo para enviar hoy.")
+        return None
+
+    with metrics.span('servicio.gmail'):
+        gmail_service = resolve(gmail_service)
+    with metrics.span('pipeline'):
+        results = run_birthday_pipeline(people, gmail_service, config, from_email, date)
+    logging.info(
+        f"Correos enviados: {len(results['enviados'])}, "
+        f"fallidos: {len(results['fallidos'])}, "
+        f"omitidos por ya enviados: {len(results['omitidos'])}, "
+        f"pendientes: {len(results['pendientes'])}"
+    )
+    return results
 
-        msg = generate_birthday_message(person)
-        subject = f"¡Feliz Cumpleaños, {nombre}!"
-        send_birthday_email(gmail_service, correo, subject, msg, from_email)
-        logging.info("-" * 30)
+def resume_birthdays(pending, gmail_service, config, from_email):
+    """Continúa una ejecución interrumpida con sus tuplas (fecha, persona) pendientes.
 
+    Cada persona se procesa con la fecha de la ejecución original, así que el
+    registro de envíos y la caché de mensajes se consultan con la misma clave.
+    """
+    logging.info(f"Continuando con {len(pending)} personas pendientes")
+    by_date = {}
+    for date, person in pending:
+        by_date.setdefault(date, []).append(person)
+    results = {'enviados': [], 'fallidos': [], 'omitidos': [], 'pendientes': []}
+    for date, people in sorted(by_date.items()):
+        delivered = deliver_birthdays(people, gmail_service, config, from_email, date)
+        for key, values in (delivered or {}).items():
+            results[key].extend(values)
+    logging.info("Bot finalizado.")
+    return results
+
+def process_hourly_birthdays(sheets_service, gmail_service, config, from_email):
+    """Envía los correos de las zonas horarias donde ahora son las config.send_hour.
+
+    Pensado para un trigger cada hora: usa el índice de la hoja (idealmente
+    desde la instantánea, ver snapshot.py) y solo consulta los cumpleaños de
+    las zonas que tocan en esta hora, cada una con su fecha local. Las filas
+    sin zona usan config.timezone o HOURLY_DEFAULT_TIMEZONE.
+    """
+    logging.info(f"Procesando cumpleaños de las zonas donde son las {config.send_hour}:00")
+    try:
+        with metrics.span('lectura'):
+            index = load_birthday_index(sheets_service, config)
+    except ratelimit.DeadlineExceeded:
+        raise
+    except Exception:
+        logging.exception("Error al leer Google Sheet")
+        return
+    if not len(index):
+        logging.info("No hay datos o error al leer la hoja.")
+        return
+    metrics.incr('filas_leidas', len(index))
+
+    due = zones_at_hour(
+        index.zone_names(), config.send_hour, config.timezone or HOURLY_DEFAULT_TIMEZONE
+    )
+    if not due:
+        logging.info("Ninguna zona horaria de la hoja tiene esta hora de envío.")
+        return
+
+    results = {'enviados': [], 'fallidos': [], 'omitidos': [], 'pendientes': []}
+    for date, zones in sorted(due.items()):
+        with metrics.span('busqueda'):
+            birthdays = index.lookup(date, zones)
+        metrics.incr('cumpleanos', len(birthdays))
+        if not birthdays:
+            continue
+        logging.info(f"{len(birthdays)} cumpleaños el {date} en {len(zones)} zonas")
+        delivered = deliver_birthdays(birthdays, gmail_service, config, from_email, date)
+        for key, values in (delivered or {}).items():
+            results[key].extend(values)
+    logging.info("Bot finalizado.")
+    return results
+
+def process_birthdays(sheets_service, gmail_service, config, from_email):
+    """Procesa los cumpleaños del día y envía los correos.
+
+    gmail_service puede ser un Lazy: solo se construye si hay a quién escribir.
+    Con config.send_hour se usa el modo por hora (process_hourly_birthdays).
+    Si la lectura de la hoja no termina antes de work_deadline se propaga
+    ratelimit.DeadlineExceeded, para que quien llama reintente en otra
+    invocación.
+    """
+    if config.send_hour is not None:
+        return process_hourly_birthdays(sheets_service, gmail_service, config, from_email)
+    logging.info("Iniciando procesamiento de cumpleaños")
+    today = today_in(config.timezone)
+    
+    if config.index_loader is not None or config.sheet_reader == 'columns':
+        try:
+            with metrics.span('lectura'):
+                index = load_birthday_index(sheets_service, config)
+        except ratelimit.DeadlineExceeded:
+            raise
+        except Exception:
+            logging.exception("Error al leer Google Sheet")
+            return
+        if not len(index):
+            logging.info("No hay datos o error al leer la hoja.")
+            return
+        logging.info(f"Datos de contactos disponibles: {len(index)} filas")
+        metrics.incr('filas_leidas', len(index))
+        with metrics.span('busqueda'):
+            birthdays = index.lookup(today)
+    elif config.sheet_reader == 'stream':
+        try:
+            # Lectura y búsqueda van juntas: cada página se filtra al llegar
+            with metrics.span('lectura'):
+                birthdays, scanned = match_birthdays(
+                    iter_sheet_records(sheets_service, config), today
+                )
+        except ratelimit.DeadlineExceeded:
+            raise
+        except Exception:
+            logging.exception("Error al leer Google Sheet")
+            scanned = 0
+        if not scanned:
+            logging.info("No hay datos o error al leer la hoja.")
+            return
+        logging.info(f"Datos leídos exitosamente de Google Sheets: {scanned} filas")
+        metrics.incr('filas_leidas', scanned)
+    else:
+        with metrics.span('lectura'):
+            df = read_sheet_data(sheets_service, config)
+        if df.empty:
+            logging.info("No hay datos o error al leer la hoja.")
+            return
+
+        logging.info(f"Datos leídos exitosamente de Google Sheets: {len(df)} filas")
+        metrics.incr('filas_leidas', len(df))
+        with metrics.span('busqueda'):
+            birthdays = get_today_birthdays(df, date=today)
+    metrics.incr('cumpleanos', len(birthdays))
+    if not birthdays:
+        logging.info("No hay cumpleaños hoy.")
+        return
+
+    logging.info(f"Hoy hay {len(birthdays)} cumpleaños:")
+    results = deliver_birthdays(birthdays, gmail_service, config, from_email, today)
     logging.info("Bot finalizado.")
+    return results